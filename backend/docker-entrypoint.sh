@@ -1,6 +1,12 @@
 #!/usr/bin/env bash
 set -euo pipefail
 
+# Usage: docker-entrypoint.sh [web|workers] (default: web)
+#   web      migrate, collectstatic, then gunicorn (plus JOB_WORKERS workers
+#            in the same container when JOB_WORKERS > 0)
+#   workers  only the background job workers, for a separate container entry
+MODE="${1:-web}"
+
 # Resolve app root
 APP_DIR="/app"
 cd "$APP_DIR"
@@ -23,21 +29,55 @@ fi
 
 export LD_LIBRARY_PATH="/usr/lib64:/lib64:${LD_LIBRARY_PATH:-}"
 
+if [ "$MODE" = "workers" ]; then
+  echo "== Starting ${JOB_WORKERS:-1} background job workers =="
+  exec python3 manage.py run_workers --processes "${JOB_WORKERS:-1}"
+elif [ "$MODE" != "web" ]; then
+  echo "Unknown mode: $MODE (expected web or workers)" >&2
+  exit 64
+fi
+
 echo "== Running Django checks =="
 python3 manage.py check || true
 
 echo "== Applying migrations =="
 python3 manage.py migrate --noinput
 
+echo "== Creating cache table =="
+python3 manage.py createcachetable
+
 echo "== Collecting static =="
 python3 manage.py collectstatic --noinput --clear
 
 PORT="${PORT:-8000}"
+GUNICORN=(gunicorn ihike_backend.wsgi:application
+  --bind "0.0.0.0:${PORT}"
+  --workers "${GUNICORN_WORKERS:-3}"
+  --timeout "${GUNICORN_TIMEOUT:-60}"
+  --access-logfile '-' --error-logfile '-')
+
+if [ "${JOB_WORKERS:-0}" -le 0 ]; then
+  echo "== Starting gunicorn on port ${PORT} =="
+  exec "${GUNICORN[@]}"
+fi
+
+# Single-container deploys: run both under this shell, forward SIGTERM/SIGINT
+# to each, and stop the other one when either exits.
+echo "== Starting ${JOB_WORKERS} background job workers =="
+python3 manage.py run_workers --processes "${JOB_WORKERS}" &
+WORKERS_PID=$!
 echo "== Starting gunicorn on port ${PORT} =="
-exec gunicorn ihike_backend.wsgi:application \
-  --bind 0.0.0.0:${PORT} \
-  --workers ${GUNICORN_WORKERS:-3} \
-  --timeout ${GUNICORN_TIMEOUT:-60} \
-  --access-logfile '-' --error-logfile '-'
+"${GUNICORN[@]}" &
+GUNICORN_PID=$!
 
+stop() {
+  kill -TERM "$GUNICORN_PID" "$WORKERS_PID" 2>/dev/null || true
+}
+trap stop TERM INT
 
+set +e
+wait -n
+STATUS=$?
+stop
+wait "$GUNICORN_PID" "$WORKERS_PID"
+exit "$STATUS"
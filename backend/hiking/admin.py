@@ -1,3 +1,36 @@
 """
-No admin registrations are required after removing server-side trail models.
+Admin views for background jobs; trail data is managed by import commands.
 """
+
+from django.contrib import admin
+
+from hiking.jobs import cancel
+from hiking.models import Job, JobSchedule
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = (
+        "id",
+        "task",
+        "status",
+        "priority",
+        "progress",
+        "progress_message",
+        "attempts",
+        "created_at",
+    )
+    list_filter = ("status", "task")
+    readonly_fields = ("worker", "heartbeat_at", "started_at", "finished_at", "error")
+    actions = ["cancel_jobs"]
+
+    @admin.action(description="Cancel selected jobs")
+    def cancel_jobs(self, request, queryset):
+        for job in queryset:
+            cancel(job.pk)
+
+
+@admin.register(JobSchedule)
+class JobScheduleAdmin(admin.ModelAdmin):
+    list_display = ("name", "task", "cron", "enabled", "next_run_at", "last_job")
+    list_filter = ("enabled",)
@@ -0,0 +1,169 @@
+"""
+Low-zoom trail clustering.
+
+Every trail contributes one point, its midpoint, to a grid hierarchy with one
+level per zoom 0..CLUSTER_MAX_ZOOM, so cluster counts are distinct trails and
+add up to the trails in view. Each level is a set
+of flat numpy arrays sorted by cell key, so bbox queries are a single
+vectorised mask and row changes are applied as +/- deltas instead of a rebuild.
+"""
+
+import threading
+
+import numpy as np
+
+from hiking.geo import lonlat_to_unit, unit_to_lonlat
+from hiking.models import DataVersion, TrailSummary
+
+CLUSTER_MAX_ZOOM = 8
+# 8 cells per 512px tile ~= 64px cluster radius, the same as supercluster.
+CELLS_PER_TILE = 8
+SAC_LEVELS = [
+    "hiking",
+    "mountain_hiking",
+    "demanding_mountain_hiking",
+    "alpine_hiking",
+    "demanding_alpine_hiking",
+    "difficult_alpine_hiking",
+    "unknown",
+]
+_SAC_INDEX = {name: i for i, name in enumerate(SAC_LEVELS)}
+ROW_FIELDS = ("mid_lon", "mid_lat", "sac_scale")
+
+
+def sac_index(value):
+    return _SAC_INDEX.get(value or "unknown", _SAC_INDEX["unknown"])
+
+
+class _Level:
+    def __init__(self):
+        self.keys = np.empty(0, dtype=np.int64)
+        self.weight = np.empty(0)
+        self.sum_x = np.empty(0)
+        self.sum_y = np.empty(0)
+        self.difficulty = np.empty((0, len(SAC_LEVELS)))
+
+    def merge(self, keys, weight, sum_x, sum_y, difficulty):
+        pos = np.searchsorted(self.keys, keys)
+        found = pos < len(self.keys)
+        found[found] = self.keys[pos[found]] == keys[found]
+        hit = pos[found]
+        self.weight[hit] += weight[found]
+        self.sum_x[hit] += sum_x[found]
+        self.sum_y[hit] += sum_y[found]
+        self.difficulty[hit] += difficulty[found]
+        new = ~found
+        if not new.any():
+            return
+        self.keys = np.concatenate((self.keys, keys[new]))
+        self.weight = np.concatenate((self.weight, weight[new]))
+        self.sum_x = np.concatenate((self.sum_x, sum_x[new]))
+        self.sum_y = np.concatenate((self.sum_y, sum_y[new]))
+        self.difficulty = np.concatenate((self.difficulty, difficulty[new]))
+        order = np.argsort(self.keys, kind="stable")
+        for name in ("keys", "weight", "sum_x", "sum_y", "difficulty"):
+            setattr(self, name, getattr(self, name)[order])
+
+
+class ClusterIndex:
+    def __init__(self, max_zoom=CLUSTER_MAX_ZOOM):
+        self.max_zoom = max_zoom
+        self.stamp = None
+        self.lock = threading.RLock()
+        self.levels = [_Level() for _ in range(max_zoom + 1)]
+
+    def build(self, rows):
+        with self.lock:
+            self.levels = [_Level() for _ in range(self.max_zoom + 1)]
+            self.apply(rows, 1)
+
+    def apply(self, rows, sign):
+        """Add (sign=1) or remove (sign=-1) trail rows given as `ROW_FIELDS` tuples."""
+        rows = list(rows)
+        if not rows:
+            return
+        lon, lat, sac = zip(*rows)
+        x, y = lonlat_to_unit(lon, lat)
+        diff = np.array([sac_index(s) for s in sac])
+        w = np.full(len(x), float(sign))
+        with self.lock:
+            for zoom, level in enumerate(self.levels):
+                n = CELLS_PER_TILE << zoom
+                cx = np.minimum((x * n).astype(np.int64), n - 1)
+                cy = np.minimum((y * n).astype(np.int64), n - 1)
+                keys, inv = np.unique(cy * n + cx, return_inverse=True)
+                difficulty = np.zeros((len(keys), len(SAC_LEVELS)))
+                np.add.at(difficulty, (inv, diff), w)
+                level.merge(
+                    keys,
+                    np.bincount(inv, weights=w),
+                    np.bincount(inv, weights=w * x),
+                    np.bincount(inv, weights=w * y),
+                    difficulty,
+                )
+
+    def query(self, bbox, zoom):
+        min_lon, min_lat, max_lon, max_lat = bbox
+        (x0, x1), (y1, y0) = lonlat_to_unit([min_lon, max_lon], [min_lat, max_lat])
+        with self.lock:
+            level = self.levels[min(max(zoom, 0), self.max_zoom)]
+            live = level.weight > 0.5
+            cx = np.divide(
+                level.sum_x, level.weight, where=live, out=np.zeros_like(level.sum_x)
+            )
+            cy = np.divide(
+                level.sum_y, level.weight, where=live, out=np.zeros_like(level.sum_y)
+            )
+            mask = live & (cx >= x0) & (cx <= x1) & (cy >= y0) & (cy <= y1)
+            lon, lat = unit_to_lonlat(cx[mask], cy[mask])
+            counts = np.rint(level.weight[mask]).astype(int)
+            difficulty = np.rint(level.difficulty[mask]).astype(int)
+        return [
+            {
+                "lon": round(float(lon[i]), 6),
+                "lat": round(float(lat[i]), 6),
+                "count": int(counts[i]),
+                "difficulty": {
+                    SAC_LEVELS[j]: int(c) for j, c in enumerate(difficulty[i]) if c
+                },
+            }
+            for i in range(len(counts))
+        ]
+
+
+_index = ClusterIndex()
+
+
+def get_index():
+    """Return the process-wide index, rebuilding it when another process changed rows."""
+    version = DataVersion.current()
+    with _index.lock:
+        if _index.stamp != version:
+            _index.build(TrailSummary.objects.values_list(*ROW_FIELDS).iterator())
+            _index.stamp = version
+    return _index
+
+
+def apply_change(old_row=None, new_row=None, version=None):
+    """
+    Apply a single saved/deleted trail as an incremental delta.
+
+    `version` is the DataVersion the change bumped to. Unless the index was at
+    the version just before it, another process changed rows in between and
+    the index is left to rebuild on the next request.
+    """
+    with _index.lock:
+        if _index.stamp is None:
+            return
+        if version is None or _index.stamp != version - 1:
+            _index.stamp = None
+            return
+        if old_row:
+            _index.apply([old_row], -1)
+        if new_row:
+            _index.apply([new_row], 1)
+        _index.stamp = version
+
+
+def row_of(instance):
+    return tuple(getattr(instance, f) for f in ROW_FIELDS)
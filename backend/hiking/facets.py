@@ -0,0 +1,320 @@
+"""
+Viewport facet counts from a precomputed multi-resolution grid.
+
+FacetCell holds trail count and length per (sac_scale, type, length bucket)
+for web-mercator tile cells at FACET_LEVELS, with trails placed by their
+midpoint. A bbox is answered by covering its interior with the coarsest cells
+that fit (at most four strips per level) and querying TrailSummary exactly
+only for the thin edge left outside the finest covered cells. Single-row
+saves/deletes adjust the affected cells (see signals.py); bulk imports rebuild
+the grid. Requests go through single_flight keyed by the bbox snapped to a
+coarse grid, so panning clients and concurrent workers share one computation.
+"""
+
+import math
+
+import numpy as np
+from django.db import models, transaction
+
+from hiking.geo import lonlat_to_unit, unit_to_lonlat
+from hiking.models import DataVersion, FacetCell, TrailSummary
+from hiking.singleflight import single_flight
+
+FACET_LEVELS = (4, 6, 8, 10, 12)
+# Same breakpoints as the ways legend colouring (trailColoring.ts).
+LENGTH_BUCKETS = ((1, "<1"), (3, "1-3"), (6, "3-6"), (10, "6-10"), (None, "10+"))
+FACET_FIELDS = ("osm_type", "category", "sac_scale", "length_bucket")
+ROW_FIELDS = ("osm_type", "category", "sac_scale", "length_km", "mid_lon", "mid_lat")
+BATCH_SIZE = 5000
+# Snapped bboxes widen each side by at most 1/SNAP_CELLS of the larger span.
+SNAP_CELLS = 256
+CACHE_TTL = 60
+
+
+def length_bucket(length_km):
+    for limit, label in LENGTH_BUCKETS:
+        if limit is None or length_km < limit:
+            return label
+
+
+def _length_bucket_expression():
+    return models.Case(
+        *[
+            models.When(length_km__lt=limit, then=models.Value(label))
+            for limit, label in LENGTH_BUCKETS
+            if limit is not None
+        ],
+        default=models.Value(LENGTH_BUCKETS[-1][1]),
+        output_field=models.CharField(),
+    )
+
+
+def rebuild_facet_grid(progress=None):
+    """
+    Recompute every FacetCell from TrailSummary; returns the number of rows.
+
+    `progress(fraction, message)` is called after loading and after each level;
+    the grid is only replaced at the end, so raising from it keeps the old one.
+    """
+    rows = list(
+        TrailSummary.objects.values_list(
+            "osm_type", "category", "sac_scale", "length_km", "mid_lon", "mid_lat"
+        ).iterator(chunk_size=BATCH_SIZE)
+    )
+    cells = []
+    if rows:
+        osm_type, category, sac, length, lon, lat = zip(*rows)
+        combos = [
+            (t, c, s or "unknown", length_bucket(km))
+            for t, c, s, km in zip(osm_type, category, sac, length)
+        ]
+        labels, combo = np.unique(
+            np.array(["\x1f".join(c) for c in combos]), return_inverse=True
+        )
+        length = np.asarray(length, dtype=np.float64)
+        ux, uy = lonlat_to_unit(lon, lat)
+        if progress:
+            progress(0.2, f"Loaded {len(rows)} trails")
+        for done, level in enumerate(FACET_LEVELS, 1):
+            n = 1 << level
+            x = np.minimum((ux * n).astype(np.int64), n - 1)
+            y = np.minimum((uy * n).astype(np.int64), n - 1)
+            key = (y * n + x) * len(labels) + combo
+            keys, inv = np.unique(key, return_inverse=True)
+            counts = np.bincount(inv)
+            lengths = np.bincount(inv, weights=length)
+            for k, cnt, km in zip(keys.tolist(), counts.tolist(), lengths.tolist()):
+                cell, c = divmod(k, len(labels))
+                cy, cx = divmod(cell, n)
+                t, cat, s, bucket = labels[c].split("\x1f")
+                cells.append(
+                    FacetCell(
+                        level=level,
+                        x=cx,
+                        y=cy,
+                        osm_type=t,
+                        category=cat,
+                        sac_scale=s,
+                        length_bucket=bucket,
+                        count=cnt,
+                        length_km=round(km, 3),
+                    )
+                )
+            if progress:
+                progress(
+                    0.2 + 0.6 * done / len(FACET_LEVELS),
+                    f"Grid level {level}: {len(cells)} cells",
+                )
+    with transaction.atomic():
+        FacetCell.objects.all().delete()
+        FacetCell.objects.bulk_create(cells, batch_size=BATCH_SIZE)
+    return len(cells)
+
+
+def apply_change(old_row=None, new_row=None):
+    """Move one saved/deleted trail (rows as `ROW_FIELDS` tuples) between cells."""
+    if old_row == new_row:
+        return
+    with transaction.atomic():
+        if old_row:
+            _add_row(old_row, -1)
+        if new_row:
+            _add_row(new_row, 1)
+
+
+def _add_row(row, sign):
+    osm_type, category, sac, length_km, lon, lat = row
+    ux, uy = lonlat_to_unit(lon, lat)
+    combo = dict(
+        osm_type=osm_type,
+        category=category,
+        sac_scale=sac or "unknown",
+        length_bucket=length_bucket(length_km),
+    )
+    km = sign * (length_km or 0.0)
+    for level in FACET_LEVELS:
+        n = 1 << level
+        x, y = min(int(ux * n), n - 1), min(int(uy * n), n - 1)
+        pk = (
+            FacetCell.objects.filter(level=level, x=x, y=y, **combo)
+            .values_list("pk", flat=True)
+            .first()
+        )
+        if pk is None:
+            # Racing creates may add a second row for a cell; queries sum them.
+            if sign > 0:
+                FacetCell.objects.create(
+                    level=level, x=x, y=y, count=1, length_km=km, **combo
+                )
+            continue
+        cell = FacetCell.objects.filter(pk=pk)
+        cell.update(
+            count=models.F("count") + sign, length_km=models.F("length_km") + km
+        )
+        if sign < 0:
+            cell.filter(count__lte=0).delete()
+
+
+def _inner_cells(bbox, level):
+    """Inclusive (x0, x1, y0, y1) of cells fully inside bbox, or None."""
+    min_lon, min_lat, max_lon, max_lat = bbox
+    (ux0, ux1), (uy0, uy1) = lonlat_to_unit([min_lon, max_lon], [max_lat, min_lat])
+    n = 1 << level
+    x0, x1 = math.ceil(ux0 * n), math.floor(ux1 * n) - 1
+    y0, y1 = math.ceil(uy0 * n), math.floor(uy1 * n) - 1
+    if x0 > x1 or y0 > y1:
+        return None
+    return x0, x1, y0, y1
+
+
+def cover(bbox):
+    """
+    Return (grid filter, covered lon/lat rect) for the bbox interior.
+
+    Each level contributes the ring between its own inner rectangle and the
+    (already covered) inner rectangle of the previous level.
+    """
+    query = models.Q(pk__in=[])
+    prev_level, prev = None, None
+    for level in FACET_LEVELS:
+        inner = _inner_cells(bbox, level)
+        if inner is None:
+            continue
+        x0, x1, y0, y1 = inner
+        if prev is None:
+            strips = [inner]
+        else:
+            f = 1 << (level - prev_level)
+            px0, px1 = prev[0] * f, (prev[1] + 1) * f - 1
+            py0, py1 = prev[2] * f, (prev[3] + 1) * f - 1
+            strips = [
+                (x0, x1, y0, py0 - 1),
+                (x0, x1, py1 + 1, y1),
+                (x0, px0 - 1, py0, py1),
+                (px1 + 1, x1, py0, py1),
+            ]
+        for sx0, sx1, sy0, sy1 in strips:
+            if sx0 <= sx1 and sy0 <= sy1:
+                query |= models.Q(level=level, x__range=(sx0, sx1), y__range=(sy0, sy1))
+        prev_level, prev = level, inner
+    if prev is None:
+        return None, None
+    n = 1 << prev_level
+    (lon0, lon1), (lat0, lat1) = unit_to_lonlat(
+        [prev[0] / n, (prev[1] + 1) / n], [prev[2] / n, (prev[3] + 1) / n]
+    )
+    return query, (float(lon0), float(lat1), float(lon1), float(lat0))
+
+
+def _accumulate(result, rows):
+    for row in rows:
+        count, km = row["count"], row["length_km"] or 0.0
+        keys = (
+            ("sac_scale", row["sac_scale"] or "unknown"),
+            ("type", f"{row['osm_type']}:{row['category']}"),
+            ("length", row["length_bucket"]),
+        )
+        result["total"]["count"] += count
+        result["total"]["length_km"] += km
+        for facet, value in keys:
+            bucket = result[facet].setdefault(value, {"count": 0, "length_km": 0.0})
+            bucket["count"] += count
+            bucket["length_km"] += km
+
+
+def edge_filter(bbox, covered):
+    """
+    TrailSummary filter for midpoints in bbox but outside the covered rect.
+
+    Built as up to four thin strips (west, east, south, north) so each is an
+    index range on the midpoint columns rather than a NOT over the whole bbox.
+    """
+    min_lon, min_lat, max_lon, max_lat = bbox
+    if covered is None:
+        return models.Q(
+            mid_lon__range=(min_lon, max_lon), mid_lat__range=(min_lat, max_lat)
+        )
+    c_min_lon, c_min_lat, c_max_lon, c_max_lat = covered
+    # Covered cells hold lon in [c_min_lon, c_max_lon), lat in (c_min_lat, c_max_lat].
+    return (
+        models.Q(
+            mid_lon__gte=min_lon,
+            mid_lon__lt=c_min_lon,
+            mid_lat__range=(min_lat, max_lat),
+        )
+        | models.Q(
+            mid_lon__gte=c_max_lon,
+            mid_lon__lte=max_lon,
+            mid_lat__range=(min_lat, max_lat),
+        )
+        | models.Q(
+            mid_lat__gte=min_lat,
+            mid_lat__lte=c_min_lat,
+            mid_lon__gte=c_min_lon,
+            mid_lon__lt=c_max_lon,
+        )
+        | models.Q(
+            mid_lat__gt=c_max_lat,
+            mid_lat__lte=max_lat,
+            mid_lon__gte=c_min_lon,
+            mid_lon__lt=c_max_lon,
+        )
+    )
+
+
+def facet_counts(bbox):
+    result = {
+        "total": {"count": 0, "length_km": 0.0},
+        "sac_scale": {},
+        "type": {},
+        "length": {},
+    }
+    grid, covered = cover(bbox)
+    if grid is not None:
+        _accumulate(
+            result,
+            FacetCell.objects.filter(grid)
+            .order_by()
+            .values(*FACET_FIELDS)
+            .annotate(count=models.Sum("count"), length_km=models.Sum("length_km")),
+        )
+
+    edges = TrailSummary.objects.filter(edge_filter(bbox, covered))
+    _accumulate(
+        result,
+        edges.annotate(length_bucket=_length_bucket_expression())
+        .order_by()
+        .values(*FACET_FIELDS)
+        .annotate(count=models.Count("id"), length_km=models.Sum("length_km")),
+    )
+
+    result["total"]["length_km"] = round(result["total"]["length_km"], 3)
+    for facet in ("sac_scale", "type", "length"):
+        for bucket in result[facet].values():
+            bucket["length_km"] = round(bucket["length_km"], 3)
+    return result
+
+
+def snap_bbox(bbox):
+    """Widen bbox outward to a power-of-two degree grid scaled to its span."""
+    min_lon, min_lat, max_lon, max_lat = bbox
+    span = max(max_lon - min_lon, max_lat - min_lat, 1e-6)
+    step = 2.0 ** math.floor(math.log2(span / SNAP_CELLS))
+    return (
+        max(math.floor(min_lon / step) * step, -180.0),
+        max(math.floor(min_lat / step) * step, -90.0),
+        min(math.ceil(max_lon / step) * step, 180.0),
+        min(math.ceil(max_lat / step) * step, 90.0),
+    )
+
+
+def cached_facet_counts(bbox):
+    """Return (snapped bbox, facet counts for it), shared across workers."""
+    snapped = snap_bbox(bbox)
+    counts = single_flight(
+        "facets:" + ",".join(repr(v) for v in snapped),
+        lambda: facet_counts(snapped),
+        version=DataVersion.current(),
+        ttl=CACHE_TTL,
+    )
+    return snapped, counts
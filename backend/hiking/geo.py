@@ -0,0 +1,109 @@
+"""
+Small numpy geometry helpers shared by the aggregate trail endpoints.
+"""
+
+from collections import Counter
+
+import numpy as np
+
+EARTH_RADIUS_M = 6371008.8
+MAX_MERCATOR_LAT = 85.051129
+
+
+def parse_bbox(value):
+    """Parse `minLon,minLat,maxLon,maxLat`; raises ValueError when malformed."""
+    try:
+        parts = [float(p) for p in (value or "").split(",")]
+    except ValueError:
+        parts = []
+    if len(parts) != 4:
+        raise ValueError("bbox must be minLon,minLat,maxLon,maxLat")
+    min_lon, min_lat, max_lon, max_lat = parts
+    if min_lon > max_lon or min_lat > max_lat:
+        raise ValueError("bbox min values must not exceed max values")
+    return (
+        max(min_lon, -180.0),
+        max(min_lat, -90.0),
+        min(max_lon, 180.0),
+        min(max_lat, 90.0),
+    )
+
+
+def lonlat_to_unit(lon, lat):
+    """Project lon/lat to web-mercator coordinates in [0, 1] (y grows south)."""
+    lon = np.asarray(lon, dtype=np.float64)
+    lat = np.clip(
+        np.asarray(lat, dtype=np.float64), -MAX_MERCATOR_LAT, MAX_MERCATOR_LAT
+    )
+    x = lon / 360.0 + 0.5
+    sin = np.sin(np.radians(lat))
+    y = 0.5 - 0.25 * np.log((1 + sin) / (1 - sin)) / np.pi
+    return np.clip(x, 0.0, 1.0), np.clip(y, 0.0, 1.0)
+
+
+def unit_to_lonlat(x, y):
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    lon = (x - 0.5) * 360.0
+    lat = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * y))))
+    return lon, lat
+
+
+def haversine_m(lon1, lat1, lon2, lat2):
+    """Vectorised great-circle distance in metres."""
+    lon1, lat1, lon2, lat2 = (
+        np.radians(np.asarray(v, dtype=np.float64)) for v in (lon1, lat1, lon2, lat2)
+    )
+    a = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def line_length_and_midpoint(coords):
+    """Return (length_m, (lon, lat) at half the length) for a list of lon/lat pairs."""
+    pts = np.asarray(coords, dtype=np.float64)[:, :2]
+    if len(pts) == 1:
+        return 0.0, (float(pts[0, 0]), float(pts[0, 1]))
+    seg = haversine_m(pts[:-1, 0], pts[:-1, 1], pts[1:, 0], pts[1:, 1])
+    cum = np.concatenate(([0.0], np.cumsum(seg)))
+    total = float(cum[-1])
+    if total == 0:
+        return 0.0, (float(pts[0, 0]), float(pts[0, 1]))
+    half = total / 2
+    i = min(int(np.searchsorted(cum, half, side="right")) - 1, len(seg) - 1)
+    t = (half - cum[i]) / seg[i] if seg[i] else 0.0
+    mid = pts[i] + t * (pts[i + 1] - pts[i])
+    return total, (float(mid[0]), float(mid[1]))
+
+
+def chain_lines(lines):
+    """
+    Order and orient lines so each one starts where the previous one ended.
+
+    Route relations list their ways in any order and direction. The chain starts
+    at an endpoint no other line shares (a route end) and greedily takes the
+    line with the nearest endpoint next, reversing it when that is its end.
+    """
+    if len(lines) < 2:
+        return lines
+    ends = np.array([[line[0][:2], line[-1][:2]] for line in lines], dtype=np.float64)
+    shared = Counter(map(tuple, ends.reshape(-1, 2).tolist()))
+    first, flip = 0, False
+    for i, (head, tail) in enumerate(ends.tolist()):
+        if shared[tuple(head)] == 1 or shared[tuple(tail)] == 1:
+            first, flip = i, shared[tuple(head)] != 1
+            break
+    order = [(first, flip)]
+    used = np.zeros(len(lines), dtype=bool)
+    used[first] = True
+    tail = ends[first, 0 if flip else 1]
+    for _ in range(len(lines) - 1):
+        gap = np.hypot(*(ends - tail).transpose(2, 0, 1))
+        gap[used] = np.inf
+        i, side = np.unravel_index(np.argmin(gap), gap.shape)
+        order.append((i, side == 1))
+        used[i] = True
+        tail = ends[i, 1 - side]
+    return [lines[i][::-1] if flip else lines[i] for i, flip in order]
@@ -0,0 +1,345 @@
+"""
+DB-backed background job queue.
+
+Tasks register with `@task(name)` and are called as `fn(ctx, **params)`.
+Workers (`manage.py run_workers`) claim the highest-priority due job, report
+progress through the JobContext (which is also where cancellation is noticed),
+and retry failures with exponential backoff. Region-chunked jobs are a parent
+that waits on one child job per region. JobSchedule rows enqueue jobs on a
+cron expression.
+"""
+
+import inspect
+import logging
+import threading
+import traceback
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from hiking.models import Job, JobSchedule
+from hiking.regions import REGIONS
+
+logger = logging.getLogger(__name__)
+
+RETRY_BASE_SECONDS = 30
+# run_job refreshes heartbeat_at this often (seconds) while a task runs.
+HEARTBEAT_INTERVAL = 60
+# Running jobs without a heartbeat for this long (dead worker) are requeued.
+STALE_AFTER = timedelta(minutes=15)
+
+TASKS = {}
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def task(name):
+    def register(fn):
+        TASKS[name] = fn
+        return fn
+
+    return register
+
+
+def get_task(name):
+    from hiking import tasks  # noqa: F401  (registers the built-in tasks)
+
+    if name not in TASKS:
+        raise ValueError(f"Unknown task '{name}'")
+    return TASKS[name]
+
+
+def check_task(name, per_region=False):
+    """Raise ValueError unless `name` is a task that can run as requested."""
+    fn = get_task(name)
+    if per_region:
+        params = inspect.signature(fn).parameters
+        takes_kwargs = any(p.kind is p.VAR_KEYWORD for p in params.values())
+        if "region" not in params and not takes_kwargs:
+            raise ValueError(f"Task '{name}' has no region parameter to chunk by")
+
+
+class JobContext:
+    def __init__(self, job):
+        self.job = job
+
+    def progress(self, fraction, message=""):
+        """Record progress and raise JobCancelled if cancellation was requested."""
+        job = self.job
+        owned = _owned(job).update(
+            progress=min(max(fraction, 0.0), 1.0),
+            progress_message=message[:255],
+            heartbeat_at=timezone.now(),
+        )
+        if not owned:
+            # Requeued to another worker; stop rather than run twice.
+            raise JobCancelled()
+        if job.parent_id:
+            _refresh_parent(job.parent_id)
+        if Job.objects.filter(pk=job.pk, cancel_requested=True).exists():
+            raise JobCancelled()
+
+
+def scale_progress(progress, start, end):
+    """Map a sub-step's 0..1 progress callback onto [start, end] of `progress`."""
+    if progress is None:
+        return None
+    return lambda fraction, message="": progress(
+        start + (end - start) * fraction, message
+    )
+
+
+def enqueue(
+    task_name,
+    params=None,
+    priority=0,
+    per_region=False,
+    run_after=None,
+    max_attempts=3,
+):
+    """Queue a job; with per_region=True, one chunk job per region under a parent."""
+    check_task(task_name, per_region)
+    params = params or {}
+    run_after = run_after or timezone.now()
+    fields = dict(task=task_name, priority=priority, max_attempts=max_attempts)
+    with transaction.atomic():
+        if not per_region:
+            return Job.objects.create(params=params, run_after=run_after, **fields)
+        parent = Job.objects.create(
+            params=params, run_after=run_after, status=Job.WAITING, **fields
+        )
+        Job.objects.bulk_create(
+            [
+                Job(
+                    params={**params, "region": region},
+                    run_after=run_after,
+                    parent=parent,
+                    **fields,
+                )
+                for region in REGIONS
+            ]
+        )
+        return parent
+
+
+def cancel(job_id):
+    """Cancel queued jobs now; running ones stop at their next progress call."""
+    ids = Q(pk=job_id) | Q(parent_id=job_id)
+    now = timezone.now()
+    Job.objects.filter(ids, status=Job.QUEUED).update(
+        status=Job.CANCELLED, finished_at=now
+    )
+    Job.objects.filter(ids, status=Job.RUNNING).update(cancel_requested=True)
+    parent_id = Job.objects.filter(pk=job_id).values_list("parent_id", flat=True)
+    for pid in [job_id, *parent_id]:
+        if pid:
+            _refresh_parent(pid)
+
+
+def claim_next(worker):
+    now = timezone.now()
+    with transaction.atomic():
+        job = (
+            Job.objects.select_for_update(skip_locked=True)
+            .filter(status=Job.QUEUED, run_after__lte=now)
+            .order_by("-priority", "run_after", "id")
+            .first()
+        )
+        if job is None:
+            return None
+        # The status guard keeps claims exclusive where row locks are unavailable.
+        claimed = Job.objects.filter(pk=job.pk, status=Job.QUEUED).update(
+            status=Job.RUNNING,
+            worker=worker,
+            attempts=F("attempts") + 1,
+            started_at=now,
+            heartbeat_at=now,
+            progress=0,
+            progress_message="",
+        )
+    if not claimed:
+        return None
+    job.refresh_from_db()
+    return job
+
+
+def run_job(job):
+    stop = threading.Event()
+    heartbeat = threading.Thread(target=_heartbeat, args=(job, stop), daemon=True)
+    heartbeat.start()
+    try:
+        result = get_task(job.task)(JobContext(job), **job.params)
+    except JobCancelled:
+        _finish(job, Job.CANCELLED)
+    except Exception:
+        error = traceback.format_exc()
+        logger.exception("Job failed", extra={"job_id": job.pk, "task": job.task})
+        if job.attempts < job.max_attempts:
+            delay = RETRY_BASE_SECONDS * 2 ** (job.attempts - 1)
+            _owned(job).update(
+                status=Job.QUEUED,
+                worker="",
+                error=error,
+                run_after=timezone.now() + timedelta(seconds=delay),
+            )
+        else:
+            _finish(job, Job.FAILED, error=error)
+    else:
+        _finish(job, Job.SUCCEEDED, result=result, progress=1.0)
+    finally:
+        stop.set()
+        heartbeat.join()
+
+
+def _heartbeat(job, stop):
+    """Keep heartbeat_at fresh so long tasks are not requeued as stale."""
+    try:
+        while not stop.wait(HEARTBEAT_INTERVAL):
+            try:
+                _owned(job).update(heartbeat_at=timezone.now())
+            except Exception:
+                logger.exception("Job heartbeat failed", extra={"job_id": job.pk})
+    finally:
+        connection.close()
+
+
+def work_once(worker):
+    """Run one due job if any; returns whether a job was run."""
+    job = claim_next(worker)
+    if job is None:
+        return False
+    run_job(job)
+    return True
+
+
+def requeue_stale(now=None):
+    """Return jobs orphaned by a dead worker to the queue (or fail them)."""
+    now = now or timezone.now()
+    stale = Job.objects.filter(status=Job.RUNNING, heartbeat_at__lt=now - STALE_AFTER)
+    stale.filter(attempts__lt=F("max_attempts")).update(
+        status=Job.QUEUED, worker="", run_after=now
+    )
+    for job in stale.filter(attempts__gte=F("max_attempts")):
+        _finish(job, Job.FAILED, error="Worker stopped sending heartbeats")
+
+
+def enqueue_due_schedules(now=None):
+    now = now or timezone.now()
+    due = JobSchedule.objects.filter(enabled=True).filter(
+        Q(next_run_at__lte=now) | Q(next_run_at__isnull=True)
+    )
+    for schedule in due:
+        # One broken schedule must not hold up the others.
+        try:
+            _enqueue_schedule(schedule, now)
+        except ValueError:
+            logger.exception("Invalid job schedule", extra={"schedule": schedule.name})
+
+
+def _enqueue_schedule(schedule, now):
+    next_run = next_cron_time(schedule.cron, now)
+    # Conditional update so only one scheduler process enqueues each run.
+    claimed = JobSchedule.objects.filter(
+        pk=schedule.pk, next_run_at=schedule.next_run_at
+    ).update(next_run_at=next_run)
+    if not claimed or schedule.next_run_at is None:
+        return
+    job = enqueue(
+        schedule.task,
+        schedule.params,
+        priority=schedule.priority,
+        per_region=schedule.per_region,
+    )
+    JobSchedule.objects.filter(pk=schedule.pk).update(last_job=job)
+
+
+def _owned(job):
+    """The job row, as long as it is still running under this claim."""
+    return Job.objects.filter(pk=job.pk, status=Job.RUNNING, worker=job.worker)
+
+
+def _finish(job, status, result=None, error="", progress=None):
+    fields = dict(status=status, finished_at=timezone.now(), result=result)
+    if error:
+        fields["error"] = error
+    if progress is not None:
+        fields["progress"] = progress
+    if _owned(job).update(**fields) and job.parent_id:
+        _refresh_parent(job.parent_id)
+
+
+def _refresh_parent(parent_id):
+    chunks = list(
+        Job.objects.filter(parent_id=parent_id).values_list("status", "progress")
+    )
+    if not chunks:
+        return
+    statuses = [s for s, _ in chunks]
+    done = sum(s in Job.FINISHED for s in statuses)
+    progress = sum(1.0 if s in Job.FINISHED else p for s, p in chunks) / len(chunks)
+    fields = dict(progress=progress, progress_message=f"{done}/{len(chunks)} chunks")
+    if done == len(chunks):
+        if Job.FAILED in statuses:
+            fields["status"] = Job.FAILED
+        elif Job.CANCELLED in statuses:
+            fields["status"] = Job.CANCELLED
+        else:
+            fields["status"] = Job.SUCCEEDED
+        fields["finished_at"] = timezone.now()
+    Job.objects.filter(pk=parent_id, status=Job.WAITING).update(**fields)
+
+
+def _cron_values(spec, lo, hi):
+    values = set()
+    for part in spec.split(","):
+        step = 1
+        if "/" in part:
+            part, step = part.split("/", 1)
+            step = int(step)
+        if part == "*":
+            start, end = lo, hi
+        elif "-" in part:
+            start, end = (int(v) for v in part.split("-", 1))
+        else:
+            start = int(part)
+            end = hi if step > 1 else start
+        if step < 1 or not lo <= start <= end <= hi:
+            raise ValueError(f"Invalid cron field '{spec}'")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+def next_cron_time(expr, after):
+    """Next minute after `after` matching `minute hour day month weekday` (0=Sun)."""
+    fields = expr.split()
+    if len(fields) != 5:
+        raise ValueError("cron expression must have 5 fields")
+    minutes, hours, days, months, weekdays = (
+        _cron_values(spec, lo, hi)
+        for spec, (lo, hi) in zip(fields, ((0, 59), (0, 23), (1, 31), (1, 12), (0, 6)))
+    )
+    # Like cron: when both day fields are restricted, either may match.
+    either_day = fields[2] != "*" and fields[4] != "*"
+
+    t = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+    limit = t + timedelta(days=366 * 5)
+    while t < limit:
+        if t.month not in months:
+            t = (t.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            continue
+        day_ok, weekday_ok = t.day in days, (t.weekday() + 1) % 7 in weekdays
+        if not ((day_ok or weekday_ok) if either_day else (day_ok and weekday_ok)):
+            t = t.replace(hour=0, minute=0) + timedelta(days=1)
+            continue
+        if t.hour not in hours:
+            t = t.replace(minute=0) + timedelta(hours=1)
+            continue
+        if t.minute not in minutes:
+            t += timedelta(minutes=1)
+            continue
+        return t
+    raise ValueError(f"cron expression '{expr}' never matches")
@@ -0,0 +1,28 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from hiking.jobs import enqueue
+
+
+class Command(BaseCommand):
+    help = "Queue a background job for `manage.py run_workers`."
+
+    def add_arguments(self, parser):
+        parser.add_argument("task")
+        parser.add_argument("--params", default="{}", help="JSON task parameters")
+        parser.add_argument("--priority", type=int, default=0)
+        parser.add_argument(
+            "--per-region",
+            action="store_true",
+            help="Split into one chunk job per region",
+        )
+
+    def handle(self, *args, task, params, priority, per_region, **options):
+        try:
+            job = enqueue(
+                task, json.loads(params), priority=priority, per_region=per_region
+            )
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        self.stdout.write(self.style.SUCCESS(f"Queued job {job.pk} ({task})"))
@@ -0,0 +1,147 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from hiking.facets import rebuild_facet_grid
+from hiking.geo import chain_lines, line_length_and_midpoint
+from hiking.jobs import scale_progress
+from hiking.models import DataVersion, TrailSummary
+
+BATCH_SIZE = 2000
+
+
+def feature_osm_id(feature):
+    props = feature.get("properties") or {}
+    raw = props.get("osm_id", props.get("@id", feature.get("id")))
+    if raw is None:
+        return None
+    try:
+        return int(str(raw).rsplit("/", 1)[-1])
+    except ValueError:
+        return None
+
+
+def feature_lines(feature):
+    geometry = feature.get("geometry") or {}
+    if geometry.get("type") == "LineString":
+        return [geometry["coordinates"]]
+    if geometry.get("type") == "MultiLineString":
+        return [line for line in geometry["coordinates"] if line]
+    return []
+
+
+def summary_from_feature(feature, osm_type):
+    osm_id = feature_osm_id(feature)
+    lines = feature_lines(feature)
+    if osm_id is None or not lines:
+        return None
+    props = feature.get("properties") or {}
+    # Route members come in any order/direction; chain them so offsets along
+    # the trail (start, midpoint, map-matched stretches) follow the route.
+    lines = chain_lines(lines)
+    coords = [pt for line in lines for pt in line]
+    _, (mid_lon, mid_lat) = line_length_and_midpoint(coords)
+    # Summed per line so gaps between members are not counted as trail.
+    length_m = sum(line_length_and_midpoint(line)[0] for line in lines)
+    category_tag = "highway" if osm_type == TrailSummary.WAY else "route"
+    lons = [pt[0] for pt in coords]
+    lats = [pt[1] for pt in coords]
+    return TrailSummary(
+        osm_id=osm_id,
+        osm_type=osm_type,
+        name=(props.get("name") or "")[:255],
+        category=(props.get(category_tag) or "")[:100],
+        sac_scale=props.get("sac_scale") or None,
+        length_km=round(length_m / 1000, 3),
+        start_lon=coords[0][0],
+        start_lat=coords[0][1],
+        mid_lon=mid_lon,
+        mid_lat=mid_lat,
+        geometry=[[[round(x, 6), round(y, 6)] for x, y, *_ in line] for line in lines],
+        min_lon=min(lons),
+        min_lat=min(lats),
+        max_lon=max(lons),
+        max_lat=max(lats),
+    )
+
+
+UPDATE_FIELDS = [
+    "name",
+    "category",
+    "sac_scale",
+    "length_km",
+    "start_lon",
+    "start_lat",
+    "mid_lon",
+    "mid_lat",
+    "geometry",
+    "min_lon",
+    "min_lat",
+    "max_lon",
+    "max_lat",
+    "updated_at",
+]
+
+
+def import_summaries(path, osm_type, progress=None):
+    """
+    Upsert trail summaries from a GeoJSON file in batches.
+
+    Returns (imported, features, facet cells). `progress(fraction, message)` is
+    called after each batch and during the facet grid rebuild; if it (or a
+    batch) raises, the batches already written still get their version bump
+    and grid rebuild.
+    """
+    with open(path, encoding="utf-8") as fh:
+        features = json.load(fh).get("features") or []
+    summaries = [summary_from_feature(f, osm_type) for f in features]
+    summaries = [s for s in summaries if s is not None]
+    written = 0
+    # bulk_create skips signals: bump the data version (cluster index and
+    # offline bundles) and rebuild the facet grid here instead.
+    try:
+        for start in range(0, len(summaries), BATCH_SIZE):
+            batch = summaries[start : start + BATCH_SIZE]
+            TrailSummary.objects.bulk_create(
+                batch,
+                update_conflicts=True,
+                unique_fields=["osm_type", "osm_id"],
+                update_fields=UPDATE_FIELDS,
+            )
+            written += len(batch)
+            if progress:
+                progress(
+                    0.8 * written / len(summaries),
+                    f"Imported {written} of {len(summaries)} trails",
+                )
+    except BaseException:
+        if written:
+            DataVersion.bump()
+            rebuild_facet_grid()
+        raise
+    DataVersion.bump()
+    cells = rebuild_facet_grid(progress=scale_progress(progress, 0.8, 1.0))
+    return len(summaries), len(features), cells
+
+
+class Command(BaseCommand):
+    help = "Upsert trail summaries from a ways/routes GeoJSON FeatureCollection."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="GeoJSON file used to build the tileset")
+        parser.add_argument(
+            "--type",
+            dest="osm_type",
+            choices=[TrailSummary.WAY, TrailSummary.ROUTE],
+            required=True,
+        )
+
+    def handle(self, *args, path, osm_type, **options):
+        try:
+            imported, total, cells = import_summaries(path, osm_type)
+        except (OSError, ValueError) as exc:
+            raise CommandError(f"Could not read {path}: {exc}")
+        self.stdout.write(
+            self.style.SUCCESS(f"Imported {imported} of {total} {osm_type} features")
+        )
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {cells} facet cells"))
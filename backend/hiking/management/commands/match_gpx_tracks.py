@@ -0,0 +1,77 @@
+import json
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from hiking.matching import GPXError, match_track, parse_gpx
+
+logger = logging.getLogger(__name__)
+
+
+def match_file(path):
+    try:
+        result = match_track(parse_gpx(Path(path).read_bytes()))
+    except (OSError, GPXError) as exc:
+        return {"file": str(path), "error": str(exc)}
+    except Exception as exc:
+        # One bad track must not abort the rest of a backfill.
+        logger.exception("GPX match failed", extra={"file": str(path)})
+        return {"file": str(path), "error": f"{type(exc).__name__}: {exc}"}
+    result.pop("geometry", None)
+    return {"file": str(path), **result}
+
+
+def _close_connections():
+    # Forked workers must open their own DB connections.
+    connections.close_all()
+
+
+class Command(BaseCommand):
+    help = "Map-match GPX tracks onto trails in parallel and write JSON lines."
+
+    def add_arguments(self, parser):
+        parser.add_argument("paths", nargs="+", help="GPX files or directories")
+        parser.add_argument(
+            "--workers", type=int, default=None, help="1 matches in-process"
+        )
+        parser.add_argument("--output", help="JSON lines file (default: stdout)")
+
+    def handle(self, *args, paths, workers, output, **options):
+        files = []
+        for raw in paths:
+            path = Path(raw)
+            files.extend(sorted(path.rglob("*.gpx")) if path.is_dir() else [path])
+        if not files:
+            raise CommandError("No GPX files found")
+
+        out = open(output, "w", encoding="utf-8") if output else self.stdout
+        started = time.monotonic()
+        try:
+            if workers == 1:
+                failed = self._write(out, map(match_file, files))
+            else:
+                _close_connections()
+                with ProcessPoolExecutor(
+                    max_workers=workers, initializer=_close_connections
+                ) as pool:
+                    failed = self._write(out, pool.map(match_file, files, chunksize=8))
+        finally:
+            if output:
+                out.close()
+
+        elapsed = max(time.monotonic() - started, 1e-9)
+        self.stderr.write(
+            f"Matched {len(files) - failed}/{len(files)} tracks in {elapsed:.1f}s "
+            f"({len(files) / elapsed:.1f} tracks/sec)"
+        )
+
+    def _write(self, out, results):
+        failed = 0
+        for result in results:
+            failed += "error" in result
+            out.write(json.dumps(result) + "\n")
+        return failed
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from hiking.facets import rebuild_facet_grid
+
+
+class Command(BaseCommand):
+    help = "Recompute the viewport facet summary grid from trail summaries."
+
+    def handle(self, *args, **options):
+        rows = rebuild_facet_grid()
+        self.stdout.write(self.style.SUCCESS(f"Wrote {rows} facet cells"))
@@ -0,0 +1,97 @@
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connections
+
+logger = logging.getLogger(__name__)
+
+SCHEDULER_INTERVAL = 15
+SHUTDOWN_GRACE = 60
+
+
+def worker_loop(index, poll, niceness, stop):
+    # Stop via the shared event so a running job can finish cleanly.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    if niceness and hasattr(os, "nice"):
+        # Heavy jobs yield the CPU to gunicorn workers on the same host.
+        os.nice(niceness)
+
+    import django
+    from django.apps import apps
+
+    if not apps.ready:
+        django.setup()
+    from hiking.jobs import work_once
+
+    worker = f"{socket.gethostname()}:{os.getpid()}:{index}"
+    while not stop.is_set():
+        close_old_connections()
+        try:
+            ran = work_once(worker)
+        except Exception:
+            logger.exception("Job worker loop error")
+            ran = False
+        if not ran:
+            stop.wait(poll)
+    connections.close_all()
+
+
+class Command(BaseCommand):
+    help = "Run background job worker processes and the cron scheduler."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--processes", type=int, default=2)
+        parser.add_argument("--poll", type=float, default=1.0, help="Idle poll seconds")
+        parser.add_argument("--nice", type=int, default=10)
+
+    def handle(self, *args, processes, poll, nice, **options):
+        from hiking.jobs import enqueue_due_schedules, requeue_stale
+
+        stop = multiprocessing.Event()
+        # Signal handlers only flip a flag; touching the Event's lock from a
+        # handler can deadlock with a wait() in progress.
+        stopping = []
+
+        def start(index):
+            proc = multiprocessing.Process(
+                target=worker_loop, args=(index, poll, nice, stop)
+            )
+            proc.start()
+            return proc
+
+        def request_stop(*_):
+            stopping.append(True)
+
+        signal.signal(signal.SIGINT, request_stop)
+        signal.signal(signal.SIGTERM, request_stop)
+
+        connections.close_all()
+        procs = [start(i) for i in range(processes)]
+        self.stdout.write(f"Started {processes} job workers")
+        while not stopping:
+            close_old_connections()
+            try:
+                enqueue_due_schedules()
+                requeue_stale()
+            except Exception:
+                logger.exception("Job scheduler error")
+            for i, proc in enumerate(procs):
+                if not proc.is_alive():
+                    logger.warning("Restarting job worker %s", i)
+                    procs[i] = start(i)
+            deadline = time.monotonic() + SCHEDULER_INTERVAL
+            while not stopping and time.monotonic() < deadline:
+                time.sleep(0.5)
+
+        stop.set()
+        for proc in procs:
+            proc.join(SHUTDOWN_GRACE)
+            if proc.is_alive():
+                proc.terminate()
+        self.stdout.write("Job workers stopped")
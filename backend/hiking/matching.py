@@ -0,0 +1,307 @@
+"""
+GPX map-matching onto trail geometries.
+
+Candidate trails come from one bbox query per track (a GiST envelope overlap
+on PostGIS, plain range filters elsewhere). Points are projected to a
+local metric plane, the K nearest segments within MATCH_RADIUS_M become HMM
+states, and a Viterbi pass (emission: GPS noise, transition: agreement between
+straight-line and along-line distance) picks the matched path. Coverage is
+measured per stored line, so route members need not be contiguous.
+"""
+
+import xml.etree.ElementTree as ET
+
+import numpy as np
+from django.db import connection
+from django.db.models import BooleanField, F, Func, Value
+
+from hiking.geo import EARTH_RADIUS_M
+from hiking.models import TrailSummary
+
+MATCH_RADIUS_M = 50.0
+GPS_SIGMA_M = 10.0
+TRANSITION_BETA_M = 50.0
+SWITCH_PENALTY_M = 25.0
+MIN_POINT_SPACING_M = 5.0
+MAX_CANDIDATES = 8
+MAX_TRACK_POINTS = 50000
+# Bounds the point x segment distance matrix built per chunk.
+MAX_MATRIX_CELLS = 2_000_000
+# Same expression as the trailsummary_bbox_gix index (migration 0012).
+ENVELOPE = "ST_MakeEnvelope(%(expressions)s, 4326)"
+
+
+class GPXError(ValueError):
+    pass
+
+
+def parse_gpx(data):
+    """Return an (n, 2) lon/lat array of track (or route) points."""
+    try:
+        root = ET.fromstring(data)
+    except ET.ParseError as exc:
+        raise GPXError(f"Invalid GPX: {exc}")
+    try:
+        points = [
+            (float(el.get("lon")), float(el.get("lat")))
+            for el in root.iter()
+            if el.tag.rsplit("}", 1)[-1] in ("trkpt", "rtept")
+            and el.get("lon") is not None
+            and el.get("lat") is not None
+        ]
+    except ValueError as exc:
+        raise GPXError(f"Invalid GPX coordinate: {exc}")
+    points = np.array(points, dtype=np.float64).reshape(-1, 2)
+    if not np.isfinite(points).all() or (np.abs(points) > (180, 90)).any():
+        raise GPXError("GPX coordinates must be finite lon/lat values")
+    if len(points) < 2:
+        raise GPXError("GPX must contain at least two track points")
+    if len(points) > MAX_TRACK_POINTS:
+        raise GPXError(f"GPX has more than {MAX_TRACK_POINTS} points")
+    return points
+
+
+class _Plane:
+    """Equirectangular projection around a reference point, in metres."""
+
+    def __init__(self, lon0, lat0):
+        self.lon0, self.lat0 = lon0, lat0
+        self.kx = np.radians(1) * EARTH_RADIUS_M * np.cos(np.radians(lat0))
+        self.ky = np.radians(1) * EARTH_RADIUS_M
+
+    def forward(self, lonlat):
+        lonlat = np.asarray(lonlat, dtype=np.float64)
+        return np.column_stack(
+            ((lonlat[:, 0] - self.lon0) * self.kx, (lonlat[:, 1] - self.lat0) * self.ky)
+        )
+
+    def inverse(self, xy):
+        return np.column_stack(
+            (xy[:, 0] / self.kx + self.lon0, xy[:, 1] / self.ky + self.lat0)
+        )
+
+
+def _thin(xy):
+    keep = [0]
+    for i in range(1, len(xy)):
+        if np.hypot(*(xy[i] - xy[keep[-1]])) >= MIN_POINT_SPACING_M:
+            keep.append(i)
+    return np.array(keep)
+
+
+def _candidate_trails(lonlat):
+    pad_lat = MATCH_RADIUS_M / (np.radians(1) * EARTH_RADIUS_M)
+    pad_lon = pad_lat / max(np.cos(np.radians(np.abs(lonlat[:, 1]).max())), 0.01)
+    min_lon, min_lat = (lonlat.min(axis=0) - (pad_lon, pad_lat)).tolist()
+    max_lon, max_lat = (lonlat.max(axis=0) + (pad_lon, pad_lat)).tolist()
+    trails = TrailSummary.objects.filter(geometry__isnull=False)
+    if connection.vendor == "postgresql":
+        track_box = Func(
+            *(Value(v) for v in (min_lon, min_lat, max_lon, max_lat)),
+            template=ENVELOPE,
+        )
+        trail_box = Func(
+            F("min_lon"), F("min_lat"), F("max_lon"), F("max_lat"), template=ENVELOPE
+        )
+        trails = trails.filter(
+            Func(
+                trail_box,
+                track_box,
+                template="%(expressions)s",
+                arg_joiner=" && ",
+                output_field=BooleanField(),
+            )
+        )
+    else:
+        trails = trails.filter(
+            min_lon__lte=max_lon,
+            max_lon__gte=min_lon,
+            min_lat__lte=max_lat,
+            max_lat__gte=min_lat,
+        )
+    return list(trails.values_list("osm_type", "osm_id", "name", "geometry"))
+
+
+def _segments(trails, plane):
+    """
+    Flatten trail lines into segment arrays.
+
+    Returns (start, end, segment line, along offset, line trail, line along
+    bounds, line end points, trail lengths). Lines are numbered so coverage and
+    transitions never assume two lines of a trail are contiguous.
+    """
+    starts, ends, seg_line, offset = [], [], [], []
+    line_trail, line_along, line_ends = [], [], []
+    totals = np.zeros(len(trails))
+    for t, (_, _, _, lines) in enumerate(trails):
+        for line in lines:
+            xy = plane.forward(line)
+            if len(xy) < 2:
+                continue
+            lengths = np.hypot(*(xy[1:] - xy[:-1]).T)
+            starts.append(xy[:-1])
+            ends.append(xy[1:])
+            seg_line.append(np.full(len(lengths), len(line_trail)))
+            offset.append(totals[t] + np.concatenate(([0.0], np.cumsum(lengths)[:-1])))
+            line_trail.append(t)
+            line_along.append((totals[t], totals[t] + lengths.sum()))
+            line_ends.append((xy[0], xy[-1]))
+            totals[t] += lengths.sum()
+    if not starts:
+        return None
+    return (
+        np.concatenate(starts),
+        np.concatenate(ends),
+        np.concatenate(seg_line),
+        np.concatenate(offset),
+        np.array(line_trail),
+        np.array(line_along),
+        np.array(line_ends),
+        totals,
+    )
+
+
+def _candidates(points, a, b):
+    """K nearest segment projections per point: (segment, distance, projected xy, t)."""
+    ab = b - a
+    ab_len2 = np.maximum((ab**2).sum(axis=1), 1e-12)
+    k = min(MAX_CANDIDATES, len(a))
+    chunk = max(1, MAX_MATRIX_CELLS // len(a))
+    seg_idx, dist, proj, frac = [], [], [], []
+    for start in range(0, len(points), chunk):
+        p = points[start : start + chunk, None, :]
+        t = np.clip(((p - a) * ab).sum(axis=2) / ab_len2, 0.0, 1.0)
+        q = a + t[..., None] * ab
+        d = np.hypot(*(p - q).transpose(2, 0, 1))
+        nearest = np.argpartition(d, k - 1, axis=1)[:, :k]
+        rows = np.arange(len(d))[:, None]
+        seg_idx.append(nearest)
+        dist.append(d[rows, nearest])
+        proj.append(q[rows, nearest])
+        frac.append(t[rows, nearest])
+    return (
+        np.concatenate(seg_idx),
+        np.concatenate(dist),
+        np.concatenate(proj),
+        np.concatenate(frac),
+    )
+
+
+def _viterbi(points, dist, proj, trail, line, along):
+    emit = np.where(dist <= MATCH_RADIUS_M, -0.5 * (dist / GPS_SIGMA_M) ** 2, -np.inf)
+    n, k = emit.shape
+    back = np.zeros((n, k), dtype=np.int64)
+    score = emit[0]
+    cols = np.arange(k)
+    for i in range(1, n):
+        step = np.hypot(*(points[i] - points[i - 1]))
+        same_line = line[i - 1][:, None] == line[i][None, :]
+        same_trail = trail[i - 1][:, None] == trail[i][None, :]
+        # Along-line distance only within one line; hops between lines of the
+        # same trail are free, switching trails pays SWITCH_PENALTY_M.
+        route = np.where(
+            same_line,
+            np.abs(along[i][None, :] - along[i - 1][:, None]),
+            np.hypot(
+                *(proj[i][None, :, :] - proj[i - 1][:, None, :]).transpose(2, 0, 1)
+            )
+            + np.where(same_trail, 0.0, SWITCH_PENALTY_M),
+        )
+        total = score[:, None] - np.abs(route - step) / TRANSITION_BETA_M
+        back[i] = np.argmax(total, axis=0)
+        score = total[back[i], cols] + emit[i]
+    path = np.zeros(n, dtype=np.int64)
+    path[-1] = np.argmax(score)
+    for i in range(n - 1, 0, -1):
+        path[i - 1] = back[i, path[i]]
+    return path
+
+
+def _line_coverage(trail, line, along, xy, line_along, line_ends):
+    """
+    Covered along-trail interval (lo, hi) per line; inf/-inf where unmatched.
+
+    Where the path hops between two lines of one trail, each interval reaches
+    the line end nearest the other side of the hop, so the stretch between the
+    last point on one line and the first on the next is not lost.
+    """
+    hops = np.flatnonzero((trail[1:] == trail[:-1]) & (line[1:] != line[:-1])) + 1
+    ext_line, ext_along = [line], [along]
+    for src, dst in ((hops - 1, hops), (hops, hops - 1)):
+        ends = line_ends[line[src]]
+        nearest = np.argmin(np.hypot(*(ends - xy[dst][:, None, :]).T).T, axis=1)
+        ext_line.append(line[src])
+        ext_along.append(line_along[line[src], nearest])
+    ext_line = np.concatenate(ext_line)
+    ext_along = np.concatenate(ext_along)
+    lo = np.full(len(line_along), np.inf)
+    hi = np.full(len(line_along), -np.inf)
+    np.minimum.at(lo, ext_line, ext_along)
+    np.maximum.at(hi, ext_line, ext_along)
+    return lo, hi
+
+
+def match_track(lonlat):
+    """Match a lon/lat track; returns hiked trails, coverage and matched geometry."""
+    lonlat = np.asarray(lonlat, dtype=np.float64)
+    result = {
+        "points": len(lonlat),
+        "matched_points": 0,
+        "trails": [],
+        "geometry": None,
+    }
+    plane = _Plane(*lonlat.mean(axis=0))
+    trails = _candidate_trails(lonlat)
+    segments = _segments(trails, plane) if trails else None
+    if segments is None:
+        return result
+    seg_a, seg_b, seg_line, seg_offset, line_trail, line_along, line_ends, totals = (
+        segments
+    )
+
+    points = plane.forward(lonlat)
+    points = points[_thin(points)]
+    seg_idx, dist, proj, frac = _candidates(points, seg_a, seg_b)
+    # Points with no trail in range are dropped before the Viterbi pass.
+    near = (dist <= MATCH_RADIUS_M).any(axis=1)
+    if near.sum() < 2:
+        return result
+    points, seg_idx, dist, proj, frac = (
+        arr[near] for arr in (points, seg_idx, dist, proj, frac)
+    )
+    line = seg_line[seg_idx]
+    trail = line_trail[line]
+    seg_len = np.hypot(*(seg_b - seg_a).T)
+    along = seg_offset[seg_idx] + frac * seg_len[seg_idx]
+
+    path = _viterbi(points, dist, proj, trail, line, along)
+    rows = np.arange(len(path))
+    matched_trail = trail[rows, path]
+    matched_line = line[rows, path]
+    matched_along = along[rows, path]
+    matched_xy = proj[rows, path]
+
+    lo, hi = _line_coverage(
+        matched_trail, matched_line, matched_along, matched_xy, line_along, line_ends
+    )
+    for t in dict.fromkeys(matched_trail.tolist()):
+        hit = (line_trail == t) & np.isfinite(lo)
+        covered = float((hi - lo)[hit].sum())
+        osm_type, osm_id, name, _ = trails[t]
+        result["trails"].append(
+            {
+                "osm_type": osm_type,
+                "osm_id": osm_id,
+                "name": name,
+                "start_m": round(float(lo[hit].min()), 1),
+                "end_m": round(float(hi[hit].max()), 1),
+                "matched_km": round(covered / 1000, 3),
+                "fraction": round(covered / totals[t], 3) if totals[t] else 0.0,
+            }
+        )
+    result["matched_points"] = int(len(path))
+    result["geometry"] = {
+        "type": "LineString",
+        "coordinates": np.round(plane.inverse(matched_xy), 6).tolist(),
+    }
+    return result
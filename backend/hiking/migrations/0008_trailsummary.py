@@ -0,0 +1,57 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("hiking", "0007_delete_route_and_ways"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TrailSummary",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("osm_id", models.BigIntegerField()),
+                (
+                    "osm_type",
+                    models.CharField(
+                        choices=[("route", "Route"), ("way", "Way")], max_length=10
+                    ),
+                ),
+                ("name", models.CharField(blank=True, max_length=255)),
+                (
+                    "category",
+                    models.CharField(blank=True, db_index=True, max_length=100),
+                ),
+                (
+                    "sac_scale",
+                    models.CharField(
+                        blank=True, db_index=True, max_length=100, null=True
+                    ),
+                ),
+                ("length_km", models.FloatField(default=0)),
+                ("start_lon", models.FloatField()),
+                ("start_lat", models.FloatField()),
+                ("mid_lon", models.FloatField()),
+                ("mid_lat", models.FloatField()),
+                ("updated_at", models.DateTimeField(auto_now=True, db_index=True)),
+            ],
+            options={
+                "ordering": ["name"],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("osm_type", "osm_id"), name="trailsummary_osm_unique"
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,43 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("hiking", "0008_trailsummary"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="trailsummary",
+            name="geometry",
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="trailsummary",
+            name="min_lon",
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="trailsummary",
+            name="min_lat",
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="trailsummary",
+            name="max_lon",
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="trailsummary",
+            name="max_lat",
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="trailsummary",
+            index=models.Index(
+                fields=["min_lon", "max_lon", "min_lat", "max_lat"],
+                name="trailsummary_bbox_idx",
+            ),
+        ),
+    ]
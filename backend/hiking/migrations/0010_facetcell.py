@@ -0,0 +1,45 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("hiking", "0009_trailsummary_geometry"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="trailsummary",
+            index=models.Index(
+                fields=["mid_lon", "mid_lat"], name="trailsummary_mid_idx"
+            ),
+        ),
+        migrations.CreateModel(
+            name="FacetCell",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("level", models.PositiveSmallIntegerField()),
+                ("x", models.PositiveIntegerField()),
+                ("y", models.PositiveIntegerField()),
+                ("osm_type", models.CharField(max_length=10)),
+                ("category", models.CharField(blank=True, max_length=100)),
+                ("sac_scale", models.CharField(max_length=100)),
+                ("length_bucket", models.CharField(max_length=10)),
+                ("count", models.PositiveIntegerField()),
+                ("length_km", models.FloatField()),
+            ],
+            options={
+                "indexes": [
+                    models.Index(fields=["level", "y", "x"], name="facetcell_cell_idx")
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+from django.db import migrations
+
+# Must stay identical to matching.ENVELOPE so the planner can use the index.
+CREATE_BBOX_GIST = (
+    "CREATE INDEX IF NOT EXISTS trailsummary_bbox_gix ON hiking_trailsummary "
+    "USING gist (ST_MakeEnvelope(min_lon, min_lat, max_lon, max_lat, 4326))"
+)
+DROP_BBOX_GIST = "DROP INDEX IF EXISTS trailsummary_bbox_gix"
+
+
+def add_bbox_gist(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(CREATE_BBOX_GIST)
+
+
+def drop_bbox_gist(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(DROP_BBOX_GIST)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("hiking", "0011_job_jobschedule"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="trailsummary",
+            name="trailsummary_bbox_idx",
+        ),
+        migrations.RunPython(add_bbox_gist, drop_bbox_gist),
+    ]
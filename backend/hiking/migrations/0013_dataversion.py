@@ -0,0 +1,32 @@
+from django.db import migrations, models
+
+
+def create_trails_version(apps, schema_editor):
+    apps.get_model("hiking", "DataVersion").objects.get_or_create(name="trails")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("hiking", "0012_trailsummary_bbox_gist"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DataVersion",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=50, unique=True)),
+                ("version", models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(create_trails_version, migrations.RunPython.noop),
+    ]
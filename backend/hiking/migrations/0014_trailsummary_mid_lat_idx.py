@@ -0,0 +1,17 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("hiking", "0013_dataversion"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="trailsummary",
+            index=models.Index(
+                fields=["mid_lat", "mid_lon"], name="trailsummary_mid_lat_idx"
+            ),
+        ),
+    ]
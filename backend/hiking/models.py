@@ -1,4 +1,194 @@
 """
-Models module intentionally left empty after migrating trails storage to the
-client. Legacy database tables were removed via Django migrations.
+Trail geometry is rendered from Mapbox vector tiles on the client. The backend
+keeps a compact per-trail summary (points, category, difficulty, length) that
+powers aggregate views such as low-zoom clusters, plus the background job queue
+that rebuilds them.
 """
+
+from django.core.exceptions import ValidationError
+from django.db import models
+from django.utils import timezone
+
+
+class TrailSummary(models.Model):
+    ROUTE = "route"
+    WAY = "way"
+    OSM_TYPE_CHOICES = [(ROUTE, "Route"), (WAY, "Way")]
+
+    osm_id = models.BigIntegerField()
+    osm_type = models.CharField(max_length=10, choices=OSM_TYPE_CHOICES)
+    name = models.CharField(max_length=255, blank=True)
+    # `highway` tag for ways, `route` tag for routes.
+    category = models.CharField(max_length=100, blank=True, db_index=True)
+    sac_scale = models.CharField(max_length=100, blank=True, null=True, db_index=True)
+    length_km = models.FloatField(default=0)
+    start_lon = models.FloatField()
+    start_lat = models.FloatField()
+    mid_lon = models.FloatField()
+    mid_lat = models.FloatField()
+    # Trail lines ([[[lon, lat], ...], ...]; route members chained end to end,
+    # coordinates rounded to 6 decimals) and their bbox for map-matching.
+    geometry = models.JSONField(null=True, blank=True)
+    min_lon = models.FloatField(null=True, blank=True)
+    min_lat = models.FloatField(null=True, blank=True)
+    max_lon = models.FloatField(null=True, blank=True)
+    max_lat = models.FloatField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        ordering = ["name"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["osm_type", "osm_id"], name="trailsummary_osm_unique"
+            ),
+        ]
+        # The bbox is indexed by a PostGIS GiST expression index
+        # (trailsummary_bbox_gix, migration 0012).
+        indexes = [
+            models.Index(fields=["mid_lon", "mid_lat"], name="trailsummary_mid_idx"),
+            # Lat-leading twin so thin north/south strips are index ranges too.
+            models.Index(
+                fields=["mid_lat", "mid_lon"], name="trailsummary_mid_lat_idx"
+            ),
+        ]
+
+    def __str__(self):
+        return self.name or f"{self.osm_type}/{self.osm_id}"
+
+
+class DataVersion(models.Model):
+    """
+    Change counter for data derived from TrailSummary (cluster index, facet
+    grid, offline bundles), bumped by the TrailSummary signals and bulk imports
+    so freshness checks are a single-row read instead of a table scan.
+    """
+
+    TRAILS = "trails"
+
+    name = models.CharField(max_length=50, unique=True)
+    version = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name} v{self.version}"
+
+    @classmethod
+    def current(cls, name=TRAILS):
+        version = cls.objects.filter(name=name).values_list("version", flat=True)
+        return version.first() or 0
+
+    @classmethod
+    def bump(cls, name=TRAILS):
+        """Increment and return the version; the row stays locked until commit."""
+        bumped = cls.objects.filter(name=name)
+        if not bumped.update(version=models.F("version") + 1):
+            cls.objects.get_or_create(name=name)
+            bumped.update(version=models.F("version") + 1)
+        return cls.current(name)
+
+
+class FacetCell(models.Model):
+    """Trail counts/length per facet combination in one web-mercator tile cell."""
+
+    level = models.PositiveSmallIntegerField()
+    x = models.PositiveIntegerField()
+    y = models.PositiveIntegerField()
+    osm_type = models.CharField(max_length=10)
+    category = models.CharField(max_length=100, blank=True)
+    sac_scale = models.CharField(max_length=100)
+    length_bucket = models.CharField(max_length=10)
+    count = models.PositiveIntegerField()
+    length_km = models.FloatField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["level", "y", "x"], name="facetcell_cell_idx"),
+        ]
+
+
+class Job(models.Model):
+    """A unit of background work picked up by `manage.py run_workers`."""
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    WAITING = "waiting"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+    STATUS_CHOICES = [
+        (QUEUED, "Queued"),
+        (RUNNING, "Running"),
+        (WAITING, "Waiting for chunks"),
+        (SUCCEEDED, "Succeeded"),
+        (FAILED, "Failed"),
+        (CANCELLED, "Cancelled"),
+    ]
+    FINISHED = (SUCCEEDED, FAILED, CANCELLED)
+
+    task = models.CharField(max_length=100)
+    params = models.JSONField(default=dict, blank=True)
+    priority = models.IntegerField(default=0)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    parent = models.ForeignKey(
+        "self", null=True, blank=True, related_name="chunks", on_delete=models.CASCADE
+    )
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    run_after = models.DateTimeField()
+    progress = models.FloatField(default=0)
+    progress_message = models.CharField(max_length=255, blank=True)
+    cancel_requested = models.BooleanField(default=False)
+    worker = models.CharField(max_length=100, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+        indexes = [
+            models.Index(
+                fields=["status", "-priority", "run_after"], name="job_claim_idx"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.task} #{self.pk} ({self.status})"
+
+
+class JobSchedule(models.Model):
+    """Cron-style recurring job (`minute hour day month weekday`)."""
+
+    name = models.CharField(max_length=100, unique=True)
+    task = models.CharField(max_length=100)
+    params = models.JSONField(default=dict, blank=True)
+    cron = models.CharField(max_length=100)
+    priority = models.IntegerField(default=0)
+    per_region = models.BooleanField(default=False)
+    enabled = models.BooleanField(default=True)
+    next_run_at = models.DateTimeField(null=True, blank=True)
+    last_job = models.ForeignKey(
+        Job, null=True, blank=True, related_name="+", on_delete=models.SET_NULL
+    )
+
+    class Meta:
+        ordering = ["name"]
+
+    def __str__(self):
+        return f"{self.name} ({self.cron})"
+
+    def clean(self):
+        from hiking.jobs import check_task, next_cron_time
+
+        errors = {}
+        try:
+            next_cron_time(self.cron, timezone.now())
+        except ValueError as exc:
+            errors["cron"] = str(exc)
+        try:
+            check_task(self.task, self.per_region)
+        except ValueError as exc:
+            errors["task"] = str(exc)
+        if errors:
+            raise ValidationError(errors)
@@ -0,0 +1,314 @@
+"""
+Offline region bundles.
+
+A bundle is a zip holding an MBTiles subset of the configured source tileset,
+a compact CSV of the trails in the area and a token search index over their
+names. Bundles are written straight to disk (never held in memory) under
+OFFLINE_BUNDLE_DIR, named by (area, zoom, data version), so repeat downloads
+are handed to the web server or object storage (see views.offline_bundle). Builds run in the background job queue; arbitrary
+bbox bundles are snapped to a coarse grid and evicted least recently served
+first once they exceed OFFLINE_BBOX_CACHE_BYTES.
+"""
+
+import csv
+import hashlib
+import io
+import json
+import math
+import os
+import re
+import sqlite3
+import tempfile
+import zipfile
+from pathlib import Path
+
+from django.conf import settings
+
+from hiking.geo import lonlat_to_unit
+from hiking.jobs import enqueue, scale_progress
+from hiking.models import DataVersion, Job, TrailSummary
+from hiking.regions import REGIONS
+from hiking.singleflight import single_flight
+
+BUILD_TASK = "build_offline_bundle"
+BUILD_PRIORITY = 10
+BBOX_PREFIX = "bbox_"
+# Degrees; bboxes are widened to this grid so nearby requests share a bundle.
+BBOX_SNAP = 0.01
+KEEP_PREVIOUS_VERSIONS = 1
+
+TRAIL_COLUMNS = (
+    "osm_type",
+    "osm_id",
+    "name",
+    "category",
+    "sac_scale",
+    "length_km",
+    "mid_lon",
+    "mid_lat",
+)
+_TOKEN_RE = re.compile(r"[a-z0-9]{2,}")
+
+
+def bundle_area(region=None, bbox=None):
+    """Return (bundle name, bbox) for a known region or an arbitrary bbox."""
+    if region:
+        if region not in REGIONS:
+            raise ValueError(f"Unknown region '{region}'")
+        return region, tuple(REGIONS[region]["bbox"])
+    min_lon, min_lat, max_lon, max_lat = (
+        round(f(round(v / BBOX_SNAP, 6)) * BBOX_SNAP, 2)
+        for f, v in zip((math.floor, math.floor, math.ceil, math.ceil), bbox)
+    )
+    bbox = (
+        max(min_lon, -180.0),
+        max(min_lat, -90.0),
+        min(max_lon, 180.0),
+        min(max_lat, 90.0),
+    )
+    return BBOX_PREFIX + "_".join(f"{v:.2f}" for v in bbox), bbox
+
+
+def source_mbtiles():
+    path = settings.OFFLINE_MBTILES_PATH
+    return Path(path) if path and os.path.exists(path) else None
+
+
+def bundle_dir():
+    path = Path(settings.OFFLINE_BUNDLE_DIR)
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def data_version(source):
+    stat = source.stat()
+    raw = f"{DataVersion.current()}:{stat.st_mtime_ns}:{stat.st_size}"
+    return hashlib.sha1(raw.encode()).hexdigest()[:12]
+
+
+def tile_ranges(bbox, max_zoom):
+    """Yield (zoom, min_col, max_col, min_tms_row, max_tms_row) covering bbox."""
+    min_lon, min_lat, max_lon, max_lat = bbox
+    (x0, x1), (y0, y1) = lonlat_to_unit([min_lon, max_lon], [max_lat, min_lat])
+    for zoom in range(max_zoom + 1):
+        n = 1 << zoom
+        col0, col1 = (min(int(v * n), n - 1) for v in (x0, x1))
+        row0, row1 = (min(int(v * n), n - 1) for v in (y0, y1))
+        # MBTiles stores rows in TMS order (origin bottom-left).
+        yield zoom, col0, col1, n - 1 - row1, n - 1 - row0
+
+
+def tile_count(bbox, max_zoom):
+    return sum(
+        (c1 - c0 + 1) * (r1 - r0 + 1)
+        for _, c0, c1, r0, r1 in tile_ranges(bbox, max_zoom)
+    )
+
+
+def default_max_zoom(bbox):
+    """Highest zoom up to OFFLINE_MAX_ZOOM whose tiles fit OFFLINE_MAX_TILES."""
+    zoom = 0
+    for candidate in range(1, settings.OFFLINE_MAX_ZOOM + 1):
+        if tile_count(bbox, candidate) > settings.OFFLINE_MAX_TILES:
+            break
+        zoom = candidate
+    return zoom
+
+
+def check_limits(bbox, max_zoom):
+    """Raise ValueError if the bundle exceeds OFFLINE_MAX_ZOOM/OFFLINE_MAX_TILES."""
+    if not 0 <= max_zoom <= settings.OFFLINE_MAX_ZOOM:
+        raise ValueError(f"max_zoom must be between 0 and {settings.OFFLINE_MAX_ZOOM}")
+    if tile_count(bbox, max_zoom) > settings.OFFLINE_MAX_TILES:
+        raise ValueError("Area too large for this zoom; lower max_zoom or the bbox")
+
+
+def bundle_path(name, max_zoom, source=None):
+    source = source or source_mbtiles()
+    return bundle_dir() / f"{name}-z{max_zoom}-{data_version(source)}.zip"
+
+
+def find_bundle(name, max_zoom):
+    """Return the path of the current bundle, or None if it is not built."""
+    path = bundle_path(name, max_zoom)
+    try:
+        if name.startswith(BBOX_PREFIX):
+            os.utime(path)  # recency for eviction
+        elif not path.exists():
+            return None
+    except FileNotFoundError:
+        return None
+    return path
+
+
+def queue_bundle_build(name, bbox, max_zoom):
+    """
+    Return the job building this bundle, queueing one if none is pending.
+
+    Returns None when OFFLINE_MAX_PENDING_BUILDS builds are already waiting.
+    """
+    params = {"region": name} if name in REGIONS else {"bbox": list(bbox)}
+    params["max_zoom"] = max_zoom
+    pending = Job.objects.filter(task=BUILD_TASK, status__in=(Job.QUEUED, Job.RUNNING))
+    job = pending.filter(params=params).first()
+    if job is None:
+        if pending.count() >= settings.OFFLINE_MAX_PENDING_BUILDS:
+            return None
+        job = enqueue(BUILD_TASK, params, priority=BUILD_PRIORITY)
+    return job
+
+
+def ensure_bundle(name, bbox, max_zoom, progress=None):
+    """Return the path of the bundle for this area, building it once if needed."""
+    source = source_mbtiles()
+    path = bundle_path(name, max_zoom, source)
+    if path.exists():
+        return path
+    # Waiters must outlast a full build, or they would start a duplicate one.
+    timeout = settings.OFFLINE_BUILD_TIMEOUT
+    built = Path(
+        single_flight(
+            f"offline:{path.name}",
+            lambda: str(build_bundle(path, source, name, bbox, max_zoom, progress)),
+            lock_timeout=timeout,
+            wait_timeout=timeout,
+        )
+    )
+    if built.exists():
+        return built
+    return build_bundle(path, source, name, bbox, max_zoom, progress)
+
+
+def build_bundle(path, source, name, bbox, max_zoom, progress=None):
+    with tempfile.TemporaryDirectory(dir=path.parent) as tmp:
+        tiles_path = Path(tmp) / "tiles.mbtiles"
+        zip_path = Path(tmp) / path.name
+        _write_tiles(
+            tiles_path, source, name, bbox, max_zoom, scale_progress(progress, 0, 0.8)
+        )
+        if progress:
+            progress(0.8, "Writing trails")
+        with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zf:
+            # Tile blobs are already gzipped; storing them avoids a second pass.
+            zf.write(tiles_path, "tiles.mbtiles", compress_type=zipfile.ZIP_STORED)
+            tokens, trail_count = _write_trails(zf, bbox)
+            zf.writestr("search.json", json.dumps(tokens, separators=(",", ":")))
+            zf.writestr(
+                "manifest.json",
+                json.dumps(
+                    {
+                        "name": name,
+                        "bbox": list(bbox),
+                        "max_zoom": max_zoom,
+                        "trails": trail_count,
+                        "columns": list(TRAIL_COLUMNS),
+                    }
+                ),
+            )
+        os.replace(zip_path, path)
+    _remove_old_versions(path, name, max_zoom)
+    if name.startswith(BBOX_PREFIX):
+        evict_bbox_bundles(keep=path)
+    return path
+
+
+def evict_bbox_bundles(keep=None):
+    """Delete the least recently served bbox bundles beyond the size cap."""
+    bundles = []
+    for path in bundle_dir().glob(f"{BBOX_PREFIX}*.zip"):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        bundles.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in bundles)
+    for _, size, path in sorted(bundles):
+        if total <= settings.OFFLINE_BBOX_CACHE_BYTES:
+            break
+        if path != keep:
+            path.unlink(missing_ok=True)
+            total -= size
+
+
+def _write_tiles(tiles_path, source, name, bbox, max_zoom, progress=None):
+    conn = sqlite3.connect(f"file:{tiles_path}", uri=True)
+    try:
+        conn.execute("ATTACH DATABASE ? AS src", (f"file:{source}?mode=ro",))
+        conn.executescript(
+            """
+            CREATE TABLE metadata (name TEXT, value TEXT);
+            CREATE TABLE tiles (
+                zoom_level INTEGER, tile_column INTEGER,
+                tile_row INTEGER, tile_data BLOB
+            );
+            CREATE UNIQUE INDEX tile_index ON tiles (zoom_level, tile_column, tile_row);
+            INSERT INTO metadata SELECT name, value FROM src.metadata
+                WHERE name NOT IN ('name', 'bounds', 'maxzoom', 'minzoom');
+            """
+        )
+        conn.executemany(
+            "INSERT INTO metadata VALUES (?, ?)",
+            [
+                ("name", name),
+                ("bounds", ",".join(str(v) for v in bbox)),
+                ("minzoom", "0"),
+                ("maxzoom", str(max_zoom)),
+            ],
+        )
+        total, done = tile_count(bbox, max_zoom), 0
+        for zoom, col0, col1, row0, row1 in tile_ranges(bbox, max_zoom):
+            conn.execute(
+                "INSERT OR IGNORE INTO tiles SELECT zoom_level, tile_column, tile_row, "
+                "tile_data FROM src.tiles WHERE zoom_level = ? "
+                "AND tile_column BETWEEN ? AND ? AND tile_row BETWEEN ? AND ?",
+                (zoom, col0, col1, row0, row1),
+            )
+            # Weighted by tiles: the deepest zoom is most of the work.
+            done += (col1 - col0 + 1) * (row1 - row0 + 1)
+            if progress:
+                progress(done / total, f"Copied tiles up to z{zoom}")
+        conn.commit()
+        conn.execute("DETACH DATABASE src")
+    finally:
+        conn.close()
+
+
+def _write_trails(zf, bbox):
+    min_lon, min_lat, max_lon, max_lat = bbox
+    rows = (
+        TrailSummary.objects.filter(
+            mid_lon__gte=min_lon,
+            mid_lon__lte=max_lon,
+            mid_lat__gte=min_lat,
+            mid_lat__lte=max_lat,
+        )
+        .order_by("osm_type", "osm_id")
+        .values_list(*TRAIL_COLUMNS)
+        .iterator(chunk_size=2000)
+    )
+    tokens = {}
+    count = 0
+    with zf.open("trails.csv", "w") as raw:
+        out = io.TextIOWrapper(raw, encoding="utf-8", newline="")
+        writer = csv.writer(out)
+        writer.writerow(TRAIL_COLUMNS)
+        for row in rows:
+            writer.writerow(row)
+            for token in set(_TOKEN_RE.findall((row[2] or "").lower())):
+                tokens.setdefault(token, []).append(count)
+            count += 1
+        out.flush()
+        out.detach()
+    return tokens, count
+
+
+def _remove_old_versions(path, name, max_zoom):
+    # The previous version stays until the next build, so downloads handed to
+    # the web server just before this one replaced it still find their file.
+    versions = sorted(
+        (p for p in path.parent.glob(f"{name}-z{max_zoom}-*.zip") if p != path),
+        key=lambda p: p.stat().st_mtime,
+        reverse=True,
+    )
+    for old in versions[KEEP_PREVIOUS_VERSIONS:]:
+        old.unlink(missing_ok=True)
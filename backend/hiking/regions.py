@@ -0,0 +1,15 @@
+"""
+Region bounding boxes mirroring `frontend/src/utils/regions/regionsMeta.ts`.
+
+Boxes are (minLon, minLat, maxLon, maxLat) from the region GeoJSON files; Alaska
+is clipped at the antimeridian to its mainland/Aleutian extent west of it.
+"""
+
+REGIONS = {
+    "northeast": {"name": "Northeast", "bbox": (-80.52, 38.93, -66.95, 47.46)},
+    "midwest": {"name": "Midwest", "bbox": (-104.06, 36.0, -80.52, 49.38)},
+    "south": {"name": "South", "bbox": (-106.65, 24.52, -75.05, 40.64)},
+    "west": {"name": "West", "bbox": (-124.76, 31.33, -102.04, 49.0)},
+    "alaska": {"name": "Alaska", "bbox": (-179.15, 51.21, -129.98, 71.39)},
+    "hawaii": {"name": "Hawaii", "bbox": (-178.33, 18.91, -154.81, 28.4)},
+}
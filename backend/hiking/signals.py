@@ -0,0 +1,60 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from hiking import clustering, facets
+from hiking.models import DataVersion, TrailSummary
+
+PREVIOUS_FIELDS = tuple(dict.fromkeys(clustering.ROW_FIELDS + facets.ROW_FIELDS))
+
+
+def _row(values, fields):
+    return tuple(values[f] for f in fields)
+
+
+def _instance_row(instance, fields):
+    return tuple(getattr(instance, f) for f in fields)
+
+
+@receiver(pre_save, sender=TrailSummary)
+def remember_previous_row(sender, instance, **kwargs):
+    previous = None
+    if instance.pk:
+        previous = (
+            sender.objects.filter(pk=instance.pk).values(*PREVIOUS_FIELDS).first()
+        )
+    instance._previous_values = previous
+
+
+@receiver(post_save, sender=TrailSummary)
+def update_facets_on_save(sender, instance, **kwargs):
+    previous = getattr(instance, "_previous_values", None)
+    facets.apply_change(
+        _row(previous, facets.ROW_FIELDS) if previous else None,
+        _instance_row(instance, facets.ROW_FIELDS),
+    )
+
+
+@receiver(post_delete, sender=TrailSummary)
+def update_facets_on_delete(sender, instance, **kwargs):
+    facets.apply_change(old_row=_instance_row(instance, facets.ROW_FIELDS))
+
+
+@receiver(post_save, sender=TrailSummary)
+def update_clusters_on_save(sender, instance, **kwargs):
+    previous = getattr(instance, "_previous_values", None)
+    old_row = _row(previous, clustering.ROW_FIELDS) if previous else None
+    new_row = clustering.row_of(instance)
+    version = DataVersion.bump()
+    transaction.on_commit(
+        lambda: clustering.apply_change(old_row, new_row, version=version)
+    )
+
+
+@receiver(post_delete, sender=TrailSummary)
+def update_clusters_on_delete(sender, instance, **kwargs):
+    old_row = clustering.row_of(instance)
+    version = DataVersion.bump()
+    transaction.on_commit(
+        lambda: clustering.apply_change(old_row=old_row, version=version)
+    )
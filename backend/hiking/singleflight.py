@@ -0,0 +1,128 @@
+"""
+Single-flight wrapper for expensive cacheable computations.
+
+Concurrent callers asking for the same key share one computation: threads in
+the same worker wait on an in-process event, other workers wait on a lock held
+in the shared Django cache. Values are kept past their TTL so waiters that time
+out can fall back to the stale copy instead of piling onto the database.
+"""
+
+import hashlib
+import threading
+import time
+import uuid
+
+from django.core.cache import cache
+
+DEFAULT_TTL = 300
+STALE_TTL = 24 * 60 * 60
+LOCK_TIMEOUT = 60
+WAIT_TIMEOUT = 15
+POLL_INTERVAL = 0.05
+# Waits on long locks (e.g. bundle builds) back off to this interval.
+MAX_POLL_INTERVAL = 5.0
+
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+def _cache_key(kind, key):
+    return f"sf:{kind}:{hashlib.sha1(key.encode()).hexdigest()}"
+
+
+def _fresh_value(entry, version):
+    if entry and entry["version"] == version and entry["fresh_until"] > time.time():
+        return True, entry["value"]
+    return False, None
+
+
+def single_flight(
+    key,
+    compute,
+    version=None,
+    ttl=DEFAULT_TTL,
+    stale_ttl=STALE_TTL,
+    lock_timeout=LOCK_TIMEOUT,
+    wait_timeout=WAIT_TIMEOUT,
+):
+    """
+    Return the cached value for `key`, computing it at most once across workers.
+
+    A cached value only counts as fresh while `version` matches (e.g. a data
+    stamp) and `ttl` has not passed; otherwise it is served only as a fallback.
+    """
+    entry = cache.get(_cache_key("v", key))
+    hit, value = _fresh_value(entry, version)
+    if hit:
+        return value
+
+    with _inflight_lock:
+        call = _inflight.get(key)
+        leader = call is None
+        if leader:
+            call = _inflight[key] = _Call()
+
+    if not leader:
+        if call.done.wait(wait_timeout):
+            if call.error is not None:
+                raise call.error
+            return call.value
+        if entry is not None:
+            return entry["value"]
+        return compute()
+
+    try:
+        call.value = _compute_shared(
+            key, compute, version, entry, ttl, stale_ttl, lock_timeout, wait_timeout
+        )
+        return call.value
+    except Exception as exc:
+        call.error = exc
+        raise
+    finally:
+        call.done.set()
+        with _inflight_lock:
+            _inflight.pop(key, None)
+
+
+def _compute_shared(
+    key, compute, version, entry, ttl, stale_ttl, lock_timeout, wait_timeout
+):
+    value_key = _cache_key("v", key)
+    lock_key = _cache_key("lock", key)
+    token = uuid.uuid4().hex
+    deadline = time.monotonic() + wait_timeout
+
+    locked = cache.add(lock_key, token, lock_timeout)
+    interval = POLL_INTERVAL
+    while not locked:
+        time.sleep(min(interval, max(deadline - time.monotonic(), 0)))
+        interval = min(interval * 2, MAX_POLL_INTERVAL)
+        hit, value = _fresh_value(cache.get(value_key), version)
+        if hit:
+            return value
+        if time.monotonic() >= deadline:
+            if entry is not None:
+                return entry["value"]
+            # No stale copy to serve: compute without the lock.
+            break
+        locked = cache.add(lock_key, token, lock_timeout)
+
+    try:
+        value = compute()
+        cache.set(
+            value_key,
+            {"version": version, "value": value, "fresh_until": time.time() + ttl},
+            ttl + stale_ttl,
+        )
+        return value
+    finally:
+        if locked and cache.get(lock_key) == token:
+            cache.delete(lock_key)
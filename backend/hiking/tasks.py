@@ -0,0 +1,41 @@
+"""
+Built-in background tasks. Enqueue with `manage.py enqueue_job <name>`.
+"""
+
+from hiking.facets import rebuild_facet_grid
+from hiking.jobs import task
+from hiking.management.commands.import_trail_summaries import import_summaries
+from hiking.offline import (
+    bundle_area,
+    check_limits,
+    default_max_zoom,
+    ensure_bundle,
+    source_mbtiles,
+)
+
+
+@task("import_trail_summaries")
+def import_trail_summaries(ctx, path, osm_type):
+    ctx.progress(0.0, f"Importing {path}")
+    imported, features, cells = import_summaries(path, osm_type, ctx.progress)
+    return {"imported": imported, "features": features, "cells": cells}
+
+
+@task("rebuild_facet_grid")
+def rebuild_facets(ctx):
+    return {"cells": rebuild_facet_grid(progress=ctx.progress)}
+
+
+@task("build_offline_bundle")
+def build_offline_bundle(ctx, region=None, bbox=None, max_zoom=None):
+    """Build a region (or bbox) bundle so downloads are served from disk."""
+    if source_mbtiles() is None:
+        raise RuntimeError("OFFLINE_MBTILES_PATH is not configured")
+    name, bbox = bundle_area(region=region, bbox=bbox)
+    if max_zoom is None:
+        max_zoom = default_max_zoom(bbox)
+    # Same caps as the download endpoint, which would refuse a larger bundle.
+    check_limits(bbox, max_zoom)
+    ctx.progress(0.0, f"Building {name} up to z{max_zoom}")
+    path = ensure_bundle(name, bbox, max_zoom, progress=ctx.progress)
+    return {"path": str(path)}
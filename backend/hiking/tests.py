@@ -1,4 +1,49 @@
-from django.test import TestCase, override_settings
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+import zipfile
+from io import BytesIO, StringIO
+from datetime import datetime, timedelta, timezone as dt_timezone
+from pathlib import Path
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from hiking import clustering, jobs, offline, singleflight
+from hiking.management.commands import import_trail_summaries as importer
+from hiking.facets import (
+    cover,
+    edge_filter,
+    facet_counts,
+    length_bucket,
+    rebuild_facet_grid,
+)
+from hiking.models import DataVersion, FacetCell, Job, JobSchedule, TrailSummary
+from hiking.singleflight import _cache_key, single_flight
+
+
+def make_trail(osm_id, lon, lat, sac_scale="hiking", **extra):
+    fields = dict(
+        osm_id=osm_id,
+        osm_type=TrailSummary.WAY,
+        name=f"Trail {osm_id}",
+        category="path",
+        sac_scale=sac_scale,
+        length_km=1.0,
+        start_lon=lon,
+        start_lat=lat,
+        mid_lon=lon + 0.001,
+        mid_lat=lat + 0.001,
+    )
+    fields.update(extra)
+    return TrailSummary.objects.create(**fields)
 
 
 class HealthTest(TestCase):
@@ -29,3 +74,822 @@ class DeprecatedEndpointsTest(TestCase):
                     f"/api/{endpoint}/sample-id/ but got {response.status_code}"
                 ),
             )
+
+
+@override_settings(ROOT_URLCONF="ihike_backend.urls")
+class TrailClustersTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        clustering._index.stamp = None
+        make_trail(1, -74.0, 40.7)
+        make_trail(2, -74.01, 40.71, sac_scale="alpine_hiking")
+        make_trail(3, -118.2, 34.05, sac_scale=None)
+
+    def get_clusters(self, bbox="-180,-85,180,85", zoom=2):
+        response = self.client.get("/api/clusters/", {"bbox": bbox, "zoom": zoom})
+        self.assertEqual(response.status_code, 200)
+        return response.json()["clusters"]
+
+    def test_low_zoom_groups_nearby_trails(self):
+        clusters = sorted(self.get_clusters(), key=lambda c: c["lon"])
+        self.assertEqual([c["count"] for c in clusters], [1, 2])
+        self.assertEqual(clusters[0]["difficulty"], {"unknown": 1})
+        self.assertEqual(clusters[1]["difficulty"], {"hiking": 1, "alpine_hiking": 1})
+
+    def test_counts_are_distinct_trails(self):
+        # A's midpoint shares a cell with B's start; B's midpoint with C's.
+        make_trail(10, -100.0, 45.0, mid_lon=-90.0, mid_lat=45.0)
+        make_trail(11, -90.0, 45.0, mid_lon=-80.0, mid_lat=45.0)
+        make_trail(
+            12, -80.0, 45.0, sac_scale="alpine_hiking", mid_lon=-80.0, mid_lat=45.0
+        )
+        clusters = sorted(
+            self.get_clusters(bbox="-105,40,-75,50", zoom=4), key=lambda c: c["lon"]
+        )
+        self.assertEqual([c["count"] for c in clusters], [1, 2])
+        self.assertEqual(clusters[0]["difficulty"], {"hiking": 1})
+        self.assertEqual(clusters[1]["difficulty"], {"hiking": 1, "alpine_hiking": 1})
+
+    def test_bbox_limits_clusters(self):
+        clusters = self.get_clusters(bbox="-80,35,-70,45")
+        self.assertEqual(len(clusters), 1)
+        self.assertEqual(clusters[0]["count"], 2)
+
+    def test_saved_rows_update_index_incrementally(self):
+        self.get_clusters()
+        with self.captureOnCommitCallbacks(execute=True):
+            make_trail(4, -118.21, 34.06)
+        self.assertEqual(clustering._index.stamp, DataVersion.current())
+        with mock.patch.object(clustering._index, "build") as build:
+            counts = sorted(c["count"] for c in self.get_clusters())
+        build.assert_not_called()
+        self.assertEqual(counts, [2, 2])
+
+    def test_other_process_change_after_local_delta_rebuilds(self):
+        self.get_clusters()
+        with self.captureOnCommitCallbacks(execute=True):
+            make_trail(4, -118.21, 34.06)
+        # Another worker's write: rows change and the version moves on.
+        TrailSummary.objects.bulk_create(
+            [
+                TrailSummary(
+                    osm_id=5,
+                    osm_type=TrailSummary.WAY,
+                    start_lon=-118.22,
+                    start_lat=34.07,
+                    mid_lon=-118.22,
+                    mid_lat=34.07,
+                )
+            ]
+        )
+        DataVersion.bump()
+        counts = sorted(c["count"] for c in self.get_clusters())
+        self.assertEqual(counts, [2, 3])
+
+    def test_deleted_rows_update_index(self):
+        self.get_clusters()
+        with self.captureOnCommitCallbacks(execute=True):
+            TrailSummary.objects.get(osm_id=3).delete()
+        counts = sorted(c["count"] for c in self.get_clusters())
+        self.assertEqual(counts, [2])
+
+    def test_warm_query_only_reads_version(self):
+        self.get_clusters()
+        with self.assertNumQueries(1):
+            self.get_clusters(bbox="-80,35,-70,45")
+
+    def test_invalid_params_return_bad_request(self):
+        for params in ({"bbox": "1,2,3"}, {"bbox": "0,0,1,1", "zoom": 12}):
+            response = self.client.get("/api/clusters/", params)
+            self.assertEqual(response.status_code, 400)
+
+
+class SingleFlightTest(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_concurrent_misses_compute_once(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.1)
+            return "tile"
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(single_flight("k", compute)))
+            for _ in range(8)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ["tile"] * 8)
+
+    def test_version_change_recomputes(self):
+        self.assertEqual(single_flight("k", lambda: 1, version=1), 1)
+        self.assertEqual(single_flight("k", lambda: 2, version=1), 1)
+        self.assertEqual(single_flight("k", lambda: 3, version=2), 3)
+
+    def test_lock_timeout_serves_stale_value(self):
+        single_flight("k", lambda: "old", version=1)
+        cache.add(_cache_key("lock", "k"), "other-worker", 60)
+        value = single_flight("k", lambda: "new", version=2, wait_timeout=0.1)
+        self.assertEqual(value, "old")
+
+    def test_lock_wait_backs_off(self):
+        single_flight("k", lambda: "old", version=1)
+        cache.add(_cache_key("lock", "k"), "other-worker", 60)
+        with mock.patch("hiking.singleflight.time.sleep") as sleep:
+            single_flight("k", lambda: "new", version=2, wait_timeout=0.5)
+        waits = [c.args[0] for c in sleep.call_args_list]
+        self.assertEqual(waits[:3], [0.05, 0.1, 0.2])
+        self.assertLessEqual(max(waits), singleflight.MAX_POLL_INTERVAL)
+
+
+@override_settings(ROOT_URLCONF="ihike_backend.urls")
+class OfflineBundleTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = Path(tmp.name)
+        source = self.tmp / "us.mbtiles"
+        conn = sqlite3.connect(source)
+        conn.executescript(
+            """
+            CREATE TABLE metadata (name TEXT, value TEXT);
+            CREATE TABLE tiles (zoom_level INTEGER, tile_column INTEGER,
+                tile_row INTEGER, tile_data BLOB);
+            INSERT INTO metadata VALUES ('format', 'pbf'), ('name', 'us');
+            INSERT INTO tiles VALUES (0, 0, 0, x'00'), (1, 0, 1, x'01'),
+                (1, 1, 1, x'02'), (2, 1, 2, x'03'), (2, 3, 0, x'04');
+            """
+        )
+        conn.commit()
+        conn.close()
+        # DEBUG lets the view stream bundles itself (no web server hand-off).
+        settings_patch = override_settings(
+            DEBUG=True,
+            OFFLINE_MBTILES_PATH=str(source),
+            OFFLINE_BUNDLE_DIR=self.tmp / "bundles",
+        )
+        settings_patch.enable()
+        self.addCleanup(settings_patch.disable)
+        make_trail(1, -74.0, 40.7, name="Long Path")
+        make_trail(2, -118.2, 34.05, name="Backbone Trail")
+
+    def download(self, **params):
+        response = self.client.get("/api/offline/bundle/", params)
+        if response.status_code == 202:
+            self.assertTrue(jobs.work_once("test-worker"))
+            response = self.client.get("/api/offline/bundle/", params)
+        self.assertEqual(response.status_code, 200)
+        return zipfile.ZipFile(BytesIO(b"".join(response.streaming_content)))
+
+    def test_region_bundle_contents(self):
+        bundle = self.download(region="northeast", max_zoom=2)
+        self.assertEqual(
+            sorted(bundle.namelist()),
+            ["manifest.json", "search.json", "tiles.mbtiles", "trails.csv"],
+        )
+        trails = bundle.read("trails.csv").decode().splitlines()
+        self.assertEqual(len(trails), 2)
+        self.assertIn("Long Path", trails[1])
+        self.assertEqual(json.loads(bundle.read("search.json"))["long"], [0])
+        tiles_path = self.tmp / "tiles.mbtiles"
+        tiles_path.write_bytes(bundle.read("tiles.mbtiles"))
+        conn = sqlite3.connect(tiles_path)
+        rows = conn.execute("SELECT zoom_level, tile_column, tile_row FROM tiles")
+        self.assertEqual(sorted(rows), [(0, 0, 0), (1, 0, 1), (2, 1, 2)])
+        conn.close()
+
+    def test_repeat_download_serves_built_file(self):
+        self.download(region="northeast", max_zoom=2)
+        with mock.patch.object(offline, "build_bundle") as build:
+            self.download(region="northeast", max_zoom=2)
+        build.assert_not_called()
+
+    def test_missing_bundle_queues_one_build(self):
+        params = {"bbox": "-74.0123,40.7,-73.9,40.8", "max_zoom": 2}
+        first = self.client.get("/api/offline/bundle/", params)
+        nearby = dict(params, bbox="-74.0101,40.7001,-73.9,40.8")
+        second = self.client.get("/api/offline/bundle/", nearby)
+        self.assertEqual((first.status_code, second.status_code), (202, 202))
+        self.assertEqual(first.json()["job"], second.json()["job"])
+        job = Job.objects.get()
+        self.assertEqual(
+            job.params, {"bbox": [-74.02, 40.7, -73.9, 40.8], "max_zoom": 2}
+        )
+        self.download(**nearby)
+
+    def test_pending_build_limit(self):
+        with override_settings(OFFLINE_MAX_PENDING_BUILDS=1):
+            self.client.get("/api/offline/bundle/", {"region": "west", "max_zoom": 2})
+            response = self.client.get(
+                "/api/offline/bundle/", {"region": "south", "max_zoom": 2}
+            )
+        self.assertEqual(response.status_code, 429)
+
+    def test_default_max_zoom_fits_tile_cap(self):
+        for region in ("northeast", "alaska"):
+            name, bbox = offline.bundle_area(region=region)
+            zoom = offline.default_max_zoom(bbox)
+            self.assertGreater(zoom, 0)
+            self.assertLessEqual(offline.tile_count(bbox, zoom), 250000)
+            self.assertGreater(offline.tile_count(bbox, zoom + 1), 250000)
+        response = self.client.get("/api/offline/bundle/", {"region": "alaska"})
+        self.assertEqual(response.status_code, 202)
+
+    def test_bbox_bundles_evicted_beyond_cap(self):
+        self.download(bbox="-75,40,-74,41", max_zoom=1)
+        old = next((self.tmp / "bundles").glob("bbox_*.zip"))
+        os.utime(old, (0, 0))
+        with override_settings(OFFLINE_BBOX_CACHE_BYTES=old.stat().st_size + 1):
+            self.download(bbox="-119,34,-118,35", max_zoom=1)
+        names = [p.name for p in (self.tmp / "bundles").glob("*.zip")]
+        self.assertEqual(len(names), 1)
+        self.assertNotEqual(names[0], old.name)
+
+    def test_build_reports_tile_progress(self):
+        name, bbox = offline.bundle_area(region="northeast")
+        seen = []
+        offline.ensure_bundle(
+            name, bbox, 2, progress=lambda f, m="": seen.append((f, m))
+        )
+        fractions = [f for f, _ in seen]
+        self.assertEqual(fractions, sorted(fractions))
+        self.assertIn((0.8, "Copied tiles up to z2"), seen)
+        self.assertIn((0.8, "Writing trails"), seen)
+
+    def test_missing_file_is_not_served(self):
+        self.download(region="northeast", max_zoom=2)
+        for path in (self.tmp / "bundles").glob("*.zip"):
+            path.unlink()
+        self.assertIsNone(offline.find_bundle("northeast", 2))
+
+    def test_built_bundle_is_handed_off(self):
+        self.download(region="northeast", max_zoom=2)
+        name = offline.find_bundle("northeast", 2).name
+        params = {"region": "northeast", "max_zoom": 2}
+        with override_settings(OFFLINE_ACCEL_REDIRECT="/protected-bundles"):
+            response = self.client.get("/api/offline/bundle/", params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["X-Accel-Redirect"], f"/protected-bundles/{name}")
+        self.assertEqual(response.content, b"")
+        with override_settings(OFFLINE_BUNDLE_URL="https://cdn.example.com/offline"):
+            response = self.client.get("/api/offline/bundle/", params)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(
+            response["Location"], f"https://cdn.example.com/offline/{name}"
+        )
+        with override_settings(DEBUG=False):
+            response = self.client.get("/api/offline/bundle/", params)
+        self.assertEqual(response.status_code, 503)
+
+    def test_previous_version_is_kept(self):
+        names = []
+        for _ in range(3):
+            self.download(region="northeast", max_zoom=2)
+            names.append(offline.find_bundle("northeast", 2).name)
+            DataVersion.bump()
+        kept = sorted(p.name for p in (self.tmp / "bundles").glob("*.zip"))
+        self.assertEqual(kept, sorted(names[1:]))
+
+    def test_task_enforces_limits(self):
+        job = jobs.enqueue(
+            "build_offline_bundle", {"region": "alaska", "max_zoom": 12}, max_attempts=1
+        )
+        jobs.work_once("test-worker")
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertIn("Area too large", job.error)
+        self.assertFalse(list((self.tmp / "bundles").glob("*.zip")))
+
+    def test_invalid_requests(self):
+        for params in ({"region": "mars"}, {"region": "west", "max_zoom": 20}):
+            response = self.client.get("/api/offline/bundle/", params)
+            self.assertEqual(response.status_code, 400)
+        with override_settings(OFFLINE_MBTILES_PATH=None):
+            response = self.client.get(
+                "/api/offline/bundle/", {"region": "west", "max_zoom": 2}
+            )
+        self.assertEqual(response.status_code, 503)
+
+
+def gpx(points):
+    pts = "".join(f'<trkpt lat="{lat}" lon="{lon}"/>' for lon, lat in points)
+    return (
+        '<gpx xmlns="http://www.topografix.com/GPX/1/1"><trk><trkseg>'
+        f"{pts}</trkseg></trk></gpx>"
+    )
+
+
+def make_line_trail(osm_id, coords):
+    lons = [c[0] for c in coords]
+    lats = [c[1] for c in coords]
+    return make_trail(
+        osm_id,
+        coords[0][0],
+        coords[0][1],
+        geometry=[coords],
+        min_lon=min(lons),
+        min_lat=min(lats),
+        max_lon=max(lons),
+        max_lat=max(lats),
+    )
+
+
+@override_settings(ROOT_URLCONF="ihike_backend.urls")
+class GPXMatchTest(TestCase):
+    def setUp(self):
+        make_line_trail(1, [[-74.0, 40.7], [-73.995, 40.7], [-73.99, 40.7]])
+        # Parallel trail ~220 m north, outside the match radius.
+        make_line_trail(2, [[-74.0, 40.702], [-73.99, 40.702]])
+        make_line_trail(3, [[-73.99, 40.7], [-73.99, 40.71]])
+
+    def post(self, body):
+        return self.client.post(
+            "/api/gpx/match/", data=body, content_type="application/gpx+xml"
+        )
+
+    def test_track_matches_hiked_trail_portion(self):
+        track = [
+            (-74.0 + i * 0.0005, 40.7 + (0.00005 if i % 2 else -0.00005))
+            for i in range(11)
+        ]
+        response = self.post(gpx(track))
+        self.assertEqual(response.status_code, 200)
+        result = response.json()
+        self.assertEqual([t["osm_id"] for t in result["trails"]], [1])
+        self.assertAlmostEqual(result["trails"][0]["fraction"], 0.5, delta=0.05)
+        self.assertEqual(result["geometry"]["type"], "LineString")
+        self.assertAlmostEqual(result["geometry"]["coordinates"][0][1], 40.7, places=5)
+
+    def test_track_switching_trails_at_junction(self):
+        track = [(-73.995 + i * 0.001, 40.7) for i in range(6)]
+        track += [(-73.99, 40.7 + i * 0.001) for i in range(1, 6)]
+        result = self.post(gpx(track)).json()
+        self.assertEqual([t["osm_id"] for t in result["trails"]], [1, 3])
+
+    def test_multilinestring_route_in_any_member_order(self):
+        a = [[-75.0, 41.0], [-74.9967, 41.0]]
+        b = [[-74.9967, 41.0], [-74.9933, 41.0]]
+        c = [[-74.9933, 41.0], [-74.99, 41.0]]
+        # Members out of order, one reversed, as route relations store them.
+        route = {
+            "type": "Feature",
+            "properties": {"osm_id": 900, "route": "hiking"},
+            "geometry": {"type": "MultiLineString", "coordinates": [c, a[::-1], b]},
+        }
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = Path(tmp.name) / "routes.geojson"
+        path.write_text(json.dumps({"type": "FeatureCollection", "features": [route]}))
+        call_command(
+            "import_trail_summaries", str(path), osm_type="route", stdout=StringIO()
+        )
+        lines = TrailSummary.objects.get(osm_id=900).geometry
+        for prev, line in zip(lines, lines[1:]):
+            self.assertEqual(prev[-1], line[0])
+
+        track = [(-75.0 + i * 0.0005, 41.0) for i in range(11)]
+        (matched,) = self.post(gpx(track)).json()["trails"]
+        self.assertAlmostEqual(matched["fraction"], 0.5, delta=0.05)
+        self.assertAlmostEqual(
+            matched["end_m"] - matched["start_m"],
+            matched["matched_km"] * 1000,
+            delta=1,
+        )
+
+        # Unchained storage still measures coverage per line.
+        TrailSummary.objects.filter(osm_id=900).update(geometry=[c, a[::-1], b])
+        (matched,) = self.post(gpx(track)).json()["trails"]
+        self.assertAlmostEqual(matched["fraction"], 0.5, delta=0.05)
+
+    def test_invalid_gpx_returns_bad_request(self):
+        self.assertEqual(self.post("<gpx>").status_code, 400)
+        self.assertEqual(self.post(gpx([(-74.0, 40.7)])).status_code, 400)
+
+    def test_oversized_upload_is_rejected(self):
+        track = [(-74.0 + i * 0.0005, 40.7) for i in range(11)]
+        upload = {"file": BytesIO(gpx(track).encode())}
+        upload["file"].name = "track.gpx"
+        with override_settings(GPX_MAX_UPLOAD_BYTES=100):
+            with mock.patch("hiking.views.parse_gpx") as parse:
+                response = self.client.post("/api/gpx/match/", upload)
+                self.assertEqual(response.status_code, 413)
+                response = self.post(gpx(track))
+                self.assertEqual(response.status_code, 413)
+        parse.assert_not_called()
+        upload["file"].seek(0)
+        response = self.client.post("/api/gpx/match/", upload)
+        self.assertEqual(response.status_code, 200)
+
+    def test_bad_coordinates_return_bad_request(self):
+        for bad in ("abc", "nan", "inf", "500"):
+            body = gpx([(-74.0, 40.7), (-74.001, 40.7)]).replace(
+                'lat="40.7"', f'lat="{bad}"', 1
+            )
+            self.assertEqual(self.post(body).status_code, 400, msg=bad)
+
+    def test_bulk_command_reports_bad_files_and_continues(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        root = Path(tmp.name)
+        track = [(-74.0 + i * 0.0005, 40.7) for i in range(11)]
+        (root / "a_good.gpx").write_text(gpx(track))
+        (root / "b_bad.gpx").write_text('<gpx><trkpt lat="abc" lon="1"/></gpx>')
+        (root / "c_good.gpx").write_text(gpx(track))
+        output = root / "out.jsonl"
+        call_command(
+            "match_gpx_tracks",
+            str(root),
+            workers=1,
+            output=str(output),
+            stderr=StringIO(),
+        )
+        results = [json.loads(line) for line in output.read_text().splitlines()]
+        self.assertEqual(len(results), 3)
+        self.assertIn("error", results[1])
+        for result in (results[0], results[2]):
+            self.assertEqual([t["osm_id"] for t in result["trails"]], [1])
+
+
+@override_settings(ROOT_URLCONF="ihike_backend.urls")
+class ViewportFacetsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        rng = random.Random(7)
+        sac = ["hiking", "mountain_hiking", "alpine_hiking", None]
+        trails = []
+        for i in range(300):
+            lon, lat = rng.uniform(-125, -67), rng.uniform(25, 49)
+            trails.append(
+                TrailSummary(
+                    osm_id=i,
+                    osm_type=TrailSummary.WAY,
+                    category=rng.choice(["path", "footway"]),
+                    sac_scale=rng.choice(sac),
+                    length_km=rng.uniform(0, 15),
+                    start_lon=lon,
+                    start_lat=lat,
+                    mid_lon=lon + 0.001,
+                    mid_lat=lat + 0.001,
+                )
+            )
+        TrailSummary.objects.bulk_create(trails)
+        rebuild_facet_grid()
+
+    def expected(self, bbox):
+        min_lon, min_lat, max_lon, max_lat = bbox
+        rows = TrailSummary.objects.filter(
+            mid_lon__gte=min_lon,
+            mid_lon__lte=max_lon,
+            mid_lat__gte=min_lat,
+            mid_lat__lte=max_lat,
+        )
+        sac, lengths = {}, {}
+        for row in rows:
+            key = row.sac_scale or "unknown"
+            sac[key] = sac.get(key, 0) + 1
+            bucket = length_bucket(row.length_km)
+            lengths[bucket] = lengths.get(bucket, 0) + 1
+        return rows.count(), sac, lengths
+
+    def test_grid_matches_exact_counts(self):
+        for bbox in (
+            (-130.0, 20.0, -60.0, 50.0),
+            (-110.3, 30.1, -90.7, 44.9),
+            (-80.0, 40.0, -79.0, 41.0),
+        ):
+            result = facet_counts(bbox)
+            count, sac, lengths = self.expected(bbox)
+            self.assertEqual(result["total"]["count"], count)
+            self.assertEqual(
+                {k: v["count"] for k, v in result["sac_scale"].items()}, sac
+            )
+            self.assertEqual(
+                {k: v["count"] for k, v in result["length"].items()}, lengths
+            )
+
+    def test_large_viewport_is_served_from_grid(self):
+        grid, covered = cover((-130.0, 20.0, -60.0, 50.0))
+        self.assertIsNotNone(grid)
+        # Finest cells reach within one level-12 cell of the bbox edge.
+        self.assertGreaterEqual(covered[0], -130.0)
+        self.assertLess(covered[0], -129.9)
+
+    def assert_grid_matches(self, bbox):
+        result = facet_counts(bbox)
+        count, sac, lengths = self.expected(bbox)
+        self.assertEqual(result["total"]["count"], count)
+        self.assertEqual({k: v["count"] for k, v in result["sac_scale"].items()}, sac)
+        self.assertEqual({k: v["count"] for k, v in result["length"].items()}, lengths)
+
+    def test_edges_are_strips_around_covered_rect(self):
+        bbox = (-110.3, 30.1, -90.7, 44.9)
+        _, covered = cover(bbox)
+        c_min_lon, c_min_lat, c_max_lon, c_max_lat = covered
+        # Trails on every corner and side of the covered rect.
+        for i, (lon, lat) in enumerate(
+            [
+                (c_min_lon, c_min_lat),
+                (c_min_lon, c_max_lat),
+                (c_max_lon, c_min_lat),
+                (c_max_lon, c_max_lat),
+                (-100.0, c_min_lat),
+                (-100.0, c_max_lat),
+                (c_min_lon, 40.0),
+                (c_max_lon, 40.0),
+            ]
+        ):
+            TrailSummary.objects.create(
+                osm_id=2000 + i,
+                osm_type=TrailSummary.WAY,
+                length_km=1,
+                start_lon=lon,
+                start_lat=lat,
+                mid_lon=lon,
+                mid_lat=lat,
+            )
+        sql = str(TrailSummary.objects.filter(edge_filter(bbox, covered)).query)
+        self.assertNotIn("NOT", sql)
+        self.assert_grid_matches(bbox)
+
+    def test_saves_and_deletes_update_grid(self):
+        bbox = (-130.0, 20.0, -60.0, 50.0)
+        make_trail(1000, -100.0, 40.0, sac_scale="alpine_hiking", length_km=12)
+        moved = TrailSummary.objects.get(osm_id=1)
+        moved.sac_scale = "hiking"
+        moved.length_km = 0.5
+        moved.mid_lon, moved.mid_lat = -90.0, 35.0
+        moved.save()
+        TrailSummary.objects.get(osm_id=2).delete()
+        with self.assertNumQueries(4):
+            # Unrelated edits leave the grid alone: pre_save lookup, UPDATE and
+            # the data version bump only.
+            moved.name = "Renamed"
+            moved.save()
+        self.assert_grid_matches(bbox)
+        rebuilt = FacetCell.objects.count()
+        rebuild_facet_grid()
+        self.assertEqual(FacetCell.objects.count(), rebuilt)
+        self.assert_grid_matches(bbox)
+
+    def test_import_rebuilds_grid(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = Path(tmp.name) / "ways.geojson"
+        feature = {
+            "type": "Feature",
+            "properties": {"osm_id": 5000, "highway": "path", "sac_scale": "hiking"},
+            "geometry": {
+                "type": "LineString",
+                "coordinates": [[-100.0, 40.0], [-100.01, 40.01]],
+            },
+        }
+        path.write_text(
+            json.dumps({"type": "FeatureCollection", "features": [feature]})
+        )
+        call_command(
+            "import_trail_summaries", str(path), osm_type="way", stdout=StringIO()
+        )
+        self.assert_grid_matches((-130.0, 20.0, -60.0, 50.0))
+
+    def test_cancelled_rebuild_keeps_grid(self):
+        # QuerySet.update skips signals, so only a rebuild would see this.
+        TrailSummary.objects.update(sac_scale="alpine_hiking")
+        seen = []
+
+        def progress(fraction, message=""):
+            seen.append(fraction)
+            if message.startswith("Grid level 8"):
+                raise jobs.JobCancelled()
+
+        with self.assertRaises(jobs.JobCancelled):
+            rebuild_facet_grid(progress=progress)
+        self.assertEqual(seen, sorted(seen))
+        self.assertEqual(len(seen), 4)
+        self.assertTrue(FacetCell.objects.exclude(sac_scale="alpine_hiking").exists())
+
+    def test_import_reports_batches_and_survives_cancel(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = Path(tmp.name) / "ways.geojson"
+        features = [
+            {
+                "type": "Feature",
+                "properties": {"osm_id": 6000 + i, "highway": "path"},
+                "geometry": {
+                    "type": "LineString",
+                    "coordinates": [[-100.0 + i, 40.0], [-100.01 + i, 40.01]],
+                },
+            }
+            for i in range(3)
+        ]
+        path.write_text(json.dumps({"type": "FeatureCollection", "features": features}))
+        seen = []
+
+        def progress(fraction, message=""):
+            seen.append((round(fraction, 2), message))
+            if message == "Imported 2 of 3 trails":
+                raise jobs.JobCancelled()
+
+        version = DataVersion.current()
+        with mock.patch.object(importer, "BATCH_SIZE", 1):
+            with self.assertRaises(jobs.JobCancelled):
+                importer.import_summaries(str(path), "way", progress)
+        self.assertEqual(
+            seen,
+            [(0.27, "Imported 1 of 3 trails"), (0.53, "Imported 2 of 3 trails")],
+        )
+        # The two written batches are visible to the clusters and the grid.
+        self.assertEqual(DataVersion.current(), version + 1)
+        self.assert_grid_matches((-130.0, 20.0, -60.0, 50.0))
+
+    def test_endpoint(self):
+        response = self.client.get("/api/facets/", {"bbox": "-130,20,-60,50"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["total"]["count"], 300)
+        response = self.client.get("/api/facets/", {"bbox": "oops"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_endpoint_shares_snapped_bbox(self):
+        response = self.client.get("/api/facets/", {"bbox": "-110.3,30.1,-90.7,44.9"})
+        snapped = response.json()["bbox"]
+        self.assertEqual(snapped, [-110.3125, 30.0625, -90.6875, 44.9375])
+        self.assertEqual(response.json()["total"]["count"], self.expected(snapped)[0])
+        with self.assertNumQueries(1):
+            # Nearby viewport: only the data version is read.
+            response = self.client.get(
+                "/api/facets/", {"bbox": "-110.31,30.09,-90.71,44.91"}
+            )
+        self.assertEqual(response.json()["bbox"], snapped)
+        make_trail(3000, -100.0, 40.0)
+        response = self.client.get("/api/facets/", {"bbox": "-110.3,30.1,-90.7,44.9"})
+        self.assertEqual(response.json()["total"]["count"], self.expected(snapped)[0])
+
+
+@jobs.task("test_echo")
+def echo_task(ctx, value=None, region=None, fail_times=0, cancel=False):
+    ctx.progress(0.5, "halfway")
+    if cancel:
+        jobs.cancel(ctx.job.pk)
+        ctx.progress(0.6)
+    if ctx.job.attempts <= fail_times:
+        raise RuntimeError("boom")
+    return {"value": value, "region": region}
+
+
+class JobQueueTest(TestCase):
+    def run_all(self):
+        while jobs.work_once("test-worker"):
+            pass
+
+    def test_priority_order_and_result(self):
+        low = jobs.enqueue("test_echo", {"value": "low"})
+        high = jobs.enqueue("test_echo", {"value": "high"}, priority=5)
+        self.assertEqual(jobs.claim_next("w").pk, high.pk)
+        low.refresh_from_db()
+        self.assertEqual(low.status, Job.QUEUED)
+
+    def test_retry_then_success(self):
+        job = jobs.enqueue("test_echo", {"fail_times": 1})
+        with self.assertLogs("hiking.jobs", "ERROR"):
+            self.run_all()
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.QUEUED)
+        self.assertIn("boom", job.error)
+        Job.objects.filter(pk=job.pk).update(run_after=job.created_at)
+        self.run_all()
+        job.refresh_from_db()
+        self.assertEqual(
+            (job.status, job.attempts, job.progress), (Job.SUCCEEDED, 2, 1.0)
+        )
+
+    def test_fails_after_max_attempts(self):
+        job = jobs.enqueue("test_echo", {"fail_times": 5}, max_attempts=1)
+        with self.assertLogs("hiking.jobs", "ERROR"):
+            self.run_all()
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+
+    def test_cancel_running_and_queued(self):
+        running = jobs.enqueue("test_echo", {"cancel": True})
+        self.run_all()
+        running.refresh_from_db()
+        self.assertEqual(running.status, Job.CANCELLED)
+        queued = jobs.enqueue("test_echo")
+        jobs.cancel(queued.pk)
+        queued.refresh_from_db()
+        self.assertEqual(queued.status, Job.CANCELLED)
+
+    def test_per_region_chunks(self):
+        parent = jobs.enqueue("test_echo", {"value": 1}, per_region=True)
+        self.assertEqual(parent.chunks.count(), 6)
+        jobs.work_once("w")
+        parent.refresh_from_db()
+        self.assertEqual(parent.status, Job.WAITING)
+        self.assertEqual(parent.progress_message, "1/6 chunks")
+        self.run_all()
+        parent.refresh_from_db()
+        self.assertEqual((parent.status, parent.progress), (Job.SUCCEEDED, 1.0))
+        regions = {c.result["region"] for c in parent.chunks.all()}
+        self.assertIn("hawaii", regions)
+
+    def test_unknown_task_rejected(self):
+        with self.assertRaises(ValueError):
+            jobs.enqueue("nope")
+
+    def test_per_region_requires_region_parameter(self):
+        with self.assertRaises(ValueError):
+            jobs.enqueue("rebuild_facet_grid", per_region=True)
+        self.assertFalse(Job.objects.exists())
+
+    def test_stale_running_job_requeued(self):
+        job = jobs.enqueue("test_echo")
+        jobs.claim_next("dead-worker")
+        jobs.requeue_stale(now=datetime.now(dt_timezone.utc) + timedelta(hours=1))
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.QUEUED)
+
+    def test_heartbeat_refreshes_running_job(self):
+        jobs.enqueue("test_echo")
+        job = jobs.claim_next("w")
+        Job.objects.filter(pk=job.pk).update(
+            heartbeat_at=datetime.now(dt_timezone.utc) - timedelta(hours=1)
+        )
+        stop = mock.Mock()
+        stop.wait.side_effect = [False, True]
+        jobs._heartbeat(job, stop)
+        jobs.requeue_stale()
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.RUNNING)
+
+    def test_requeued_job_is_not_finished_by_previous_worker(self):
+        jobs.enqueue("test_echo", {"value": 1})
+        old = jobs.claim_next("old-worker")
+        jobs.requeue_stale(now=datetime.now(dt_timezone.utc) + timedelta(hours=1))
+        Job.objects.filter(pk=old.pk).update(run_after=old.created_at)
+        new = jobs.claim_next("new-worker")
+        jobs.run_job(old)
+        new.refresh_from_db()
+        self.assertEqual((new.status, new.worker), (Job.RUNNING, "new-worker"))
+        jobs.run_job(new)
+        new.refresh_from_db()
+        self.assertEqual((new.status, new.attempts), (Job.SUCCEEDED, 2))
+
+
+class JobScheduleTest(TestCase):
+    def test_next_cron_time(self):
+        after = datetime(2026, 10, 18, 23, 14, tzinfo=dt_timezone.utc)
+        cases = {
+            "*/15 * * * *": datetime(2026, 10, 18, 23, 15),
+            "0 3 * * *": datetime(2026, 10, 19, 3, 0),
+            "30 2 * * 1": datetime(2026, 10, 19, 2, 30),
+            "0 0 1 1-3 *": datetime(2027, 1, 1, 0, 0),
+        }
+        for expr, expected in cases.items():
+            self.assertEqual(
+                jobs.next_cron_time(expr, after),
+                expected.replace(tzinfo=dt_timezone.utc),
+                msg=expr,
+            )
+        with self.assertRaises(ValueError):
+            jobs.next_cron_time("61 * * * *", after)
+
+    def test_due_schedule_enqueues_once(self):
+        now = datetime(2026, 10, 18, 23, 14, tzinfo=dt_timezone.utc)
+        schedule = JobSchedule.objects.create(
+            name="nightly", task="test_echo", cron="0 3 * * *", next_run_at=now
+        )
+        jobs.enqueue_due_schedules(now)
+        jobs.enqueue_due_schedules(now)
+        schedule.refresh_from_db()
+        self.assertEqual(Job.objects.filter(task="test_echo").count(), 1)
+        self.assertEqual(schedule.last_job.task, "test_echo")
+        self.assertEqual(schedule.next_run_at.hour, 3)
+
+    def test_invalid_schedule_does_not_block_others(self):
+        now = datetime(2026, 10, 18, 23, 14, tzinfo=dt_timezone.utc)
+        JobSchedule.objects.create(
+            name="a-broken", task="test_echo", cron="61 * * * *", next_run_at=now
+        )
+        JobSchedule.objects.create(
+            name="b-nightly", task="test_echo", cron="0 3 * * *", next_run_at=now
+        )
+        with self.assertLogs("hiking.jobs", "ERROR"):
+            jobs.enqueue_due_schedules(now)
+        self.assertEqual(Job.objects.filter(task="test_echo").count(), 1)
+
+    def test_schedule_clean_validates_cron_and_task(self):
+        schedule = JobSchedule(
+            name="bad", task="rebuild_facet_grid", cron="* *", per_region=True
+        )
+        with self.assertRaises(ValidationError) as ctx:
+            schedule.full_clean()
+        self.assertEqual(set(ctx.exception.message_dict), {"cron", "task"})
+        JobSchedule(name="ok", task="rebuild_facet_grid", cron="0 3 * * *").full_clean()
@@ -1,8 +1,23 @@
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework import status
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, HttpResponseRedirect
 import logging
 
+from hiking.clustering import CLUSTER_MAX_ZOOM, get_index
+from hiking.facets import cached_facet_counts
+from hiking.geo import parse_bbox
+from hiking.matching import GPXError, match_track, parse_gpx
+from hiking.offline import (
+    bundle_area,
+    check_limits,
+    default_max_zoom,
+    find_bundle,
+    queue_bundle_build,
+    source_mbtiles,
+)
+
 
 logger = logging.getLogger(__name__)
 
@@ -21,3 +36,113 @@ def deprecated_gone(request, *args, **kwargs):
         {"detail": "Trails API removed. Use vector tiles."},
         status=status.HTTP_410_GONE,
     )
+
+
+@api_view(["GET"])
+def trail_clusters(request):
+    try:
+        bbox = parse_bbox(request.query_params.get("bbox"))
+        zoom = int(request.query_params.get("zoom", 0))
+    except ValueError as exc:
+        return Response({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+    if not 0 <= zoom <= CLUSTER_MAX_ZOOM:
+        return Response(
+            {"detail": f"zoom must be between 0 and {CLUSTER_MAX_ZOOM}"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    return Response({"zoom": zoom, "clusters": get_index().query(bbox, zoom)})
+
+
+@api_view(["GET"])
+def offline_bundle(request):
+    try:
+        region = request.query_params.get("region")
+        if region:
+            name, bbox = bundle_area(region=region)
+        else:
+            name, bbox = bundle_area(bbox=parse_bbox(request.query_params.get("bbox")))
+        max_zoom = request.query_params.get("max_zoom")
+        max_zoom = default_max_zoom(bbox) if max_zoom is None else int(max_zoom)
+        check_limits(bbox, max_zoom)
+    except ValueError as exc:
+        return Response({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+    if source_mbtiles() is None:
+        return Response(
+            {"detail": "Offline tiles are not configured."},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE,
+        )
+    path = find_bundle(name, max_zoom)
+    if path is not None:
+        return _bundle_response(path)
+    # Builds run on the job workers; clients poll until the file is ready.
+    job = queue_bundle_build(name, bbox, max_zoom)
+    if job is None:
+        return Response(
+            {"detail": "Too many offline bundles are being built; retry later."},
+            status=status.HTTP_429_TOO_MANY_REQUESTS,
+            headers={"Retry-After": "60"},
+        )
+    return Response(
+        {
+            "detail": "Bundle is being built; retry shortly.",
+            "job": job.pk,
+            "status": job.status,
+            "progress": job.progress,
+        },
+        status=status.HTTP_202_ACCEPTED,
+        headers={"Retry-After": "10"},
+    )
+
+
+def _bundle_response(path):
+    # Zips can be hundreds of MB; never stream them through a gunicorn worker.
+    if settings.OFFLINE_BUNDLE_URL:
+        return HttpResponseRedirect(f"{settings.OFFLINE_BUNDLE_URL}/{path.name}")
+    if settings.OFFLINE_ACCEL_REDIRECT:
+        response = HttpResponse(content_type="application/zip")
+        response["X-Accel-Redirect"] = f"{settings.OFFLINE_ACCEL_REDIRECT}/{path.name}"
+        response["Content-Disposition"] = f'attachment; filename="{path.name}"'
+        return response
+    if settings.DEBUG:
+        return FileResponse(open(path, "rb"), as_attachment=True)
+    return Response(
+        {"detail": "Offline bundle delivery is not configured."},
+        status=status.HTTP_503_SERVICE_UNAVAILABLE,
+    )
+
+
+@api_view(["POST"])
+def match_gpx(request):
+    too_large = Response(
+        {"detail": f"GPX must be at most {settings.GPX_MAX_UPLOAD_BYTES} bytes"},
+        status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+    )
+    try:
+        length = int(request.META.get("CONTENT_LENGTH") or 0)
+    except ValueError:
+        length = 0
+    if length > settings.GPX_MAX_UPLOAD_BYTES:
+        return too_large
+    if request.content_type.startswith("multipart/"):
+        upload = request.FILES.get("file")
+        # Chunked uploads carry no Content-Length; check the spooled size.
+        if upload and upload.size > settings.GPX_MAX_UPLOAD_BYTES:
+            return too_large
+        data = upload.read() if upload else b""
+    else:
+        data = request.body
+    try:
+        track = parse_gpx(data)
+    except GPXError as exc:
+        return Response({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(match_track(track))
+
+
+@api_view(["GET"])
+def viewport_facets(request):
+    try:
+        bbox = parse_bbox(request.query_params.get("bbox"))
+    except ValueError as exc:
+        return Response({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+    snapped, counts = cached_facet_counts(bbox)
+    return Response({"bbox": list(snapped), **counts})
@@ -157,6 +157,25 @@ else:
 # 3. psycopg2 handles connection details correctly when given proper DATABASE_URL
 
 
+# Cache
+# Shared between gunicorn workers so single-flight locks and cached responses
+# collapse concurrent misses to one computation. Create the table with
+# `python manage.py createcachetable`.
+CACHES = {
+    "default": {
+        "BACKEND": os.getenv(
+            "CACHE_BACKEND", "django.core.cache.backends.db.DatabaseCache"
+        ),
+        "LOCATION": os.getenv("CACHE_LOCATION", "ihike_cache"),
+    }
+}
+if CACHES["default"]["BACKEND"].endswith("DatabaseCache"):
+    # The default cull (300 entries) would evict single-flight locks.
+    CACHES["default"]["OPTIONS"] = {
+        "MAX_ENTRIES": int(os.getenv("CACHE_MAX_ENTRIES", "50000"))
+    }
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -265,6 +284,27 @@ CORS_ALLOW_CREDENTIALS = os.getenv("CORS_ALLOW_CREDENTIALS", "false").lower() in
 if DEBUG and not CORS_ALLOWED_ORIGINS:
     CORS_ALLOW_ALL_ORIGINS = True
 
+# Offline bundles: source MBTiles (tippecanoe output of the US tilesets) and
+# the directory where built bundles are kept and served from.
+OFFLINE_MBTILES_PATH = os.getenv("OFFLINE_MBTILES_PATH")
+OFFLINE_BUNDLE_DIR = Path(
+    os.getenv("OFFLINE_BUNDLE_DIR", str(BASE_DIR / "offline_bundles"))
+)
+OFFLINE_MAX_ZOOM = int(os.getenv("OFFLINE_MAX_ZOOM", "14"))
+OFFLINE_MAX_TILES = int(os.getenv("OFFLINE_MAX_TILES", "250000"))
+# Disk budget for bundles of arbitrary bboxes (region bundles are not evicted).
+OFFLINE_BBOX_CACHE_BYTES = int(os.getenv("OFFLINE_BBOX_CACHE_BYTES", str(2 * 1024**3)))
+OFFLINE_MAX_PENDING_BUILDS = int(os.getenv("OFFLINE_MAX_PENDING_BUILDS", "20"))
+OFFLINE_BUILD_TIMEOUT = int(os.getenv("OFFLINE_BUILD_TIMEOUT", "3600"))
+# Bundle delivery (one is required unless DEBUG): a public URL prefix the bundle
+# dir is served or synced under (302 redirect), or an nginx `internal` location
+# aliased to OFFLINE_BUNDLE_DIR (X-Accel-Redirect).
+OFFLINE_BUNDLE_URL = os.getenv("OFFLINE_BUNDLE_URL", "").rstrip("/")
+OFFLINE_ACCEL_REDIRECT = os.getenv("OFFLINE_ACCEL_REDIRECT", "").rstrip("/")
+
+# GPX map-matching: uploads above this are rejected before parsing.
+GPX_MAX_UPLOAD_BYTES = int(os.getenv("GPX_MAX_UPLOAD_BYTES", str(10 * 1024**2)))
+
 # Trails API deprecation flag (default enabled)
 TRAILS_API_DEPRECATED = os.getenv("TRAILS_API_DEPRECATED", "true").lower() in (
     "1",
@@ -64,4 +64,15 @@ STATIC_ROOT = BASE_DIR / "staticfiles"
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
+OFFLINE_MBTILES_PATH = None
+OFFLINE_BUNDLE_DIR = BASE_DIR / "offline_bundles"
+OFFLINE_MAX_ZOOM = 14
+OFFLINE_MAX_TILES = 250000
+OFFLINE_BBOX_CACHE_BYTES = 2 * 1024**3
+OFFLINE_MAX_PENDING_BUILDS = 20
+OFFLINE_BUILD_TIMEOUT = 3600
+OFFLINE_BUNDLE_URL = ""
+OFFLINE_ACCEL_REDIRECT = ""
+GPX_MAX_UPLOAD_BYTES = 10 * 1024**2
+
 MIGRATION_MODULES = {"hiking": None}
@@ -17,7 +17,13 @@ Including another URLconf
 
 from django.urls import path
 from django.http import JsonResponse
-from hiking.views import deprecated_gone
+from hiking.views import (
+    deprecated_gone,
+    match_gpx,
+    offline_bundle,
+    trail_clusters,
+    viewport_facets,
+)
 from django.apps import apps
 from django.contrib import admin
 
@@ -29,6 +35,10 @@ def health(_request):
 urlpatterns = [
     path("", health, name="root-health"),
     path("health/", health, name="health"),
+    path("api/clusters/", trail_clusters, name="trail-clusters"),
+    path("api/offline/bundle/", offline_bundle, name="offline-bundle"),
+    path("api/gpx/match/", match_gpx, name="gpx-match"),
+    path("api/facets/", viewport_facets, name="viewport-facets"),
 ]
 
 if apps.is_installed("django.contrib.admin"):